@@ -1,11 +1,17 @@
 # Copyright (C) 2020 GrammaTech, Inc.
+import hashlib
 import logging as log
 import os
+import shutil
 import tempfile
 import subprocess
+import threading
 
 from gtirb import *
 
+from gtirbtools.splice import AsmLayout
+from gtirbtools.timing import note, phase
+
 
 class BuildError(Exception):
     """Base class for exceptions in this module."""
@@ -24,41 +30,256 @@ class CompilerError(BuildError):
         self.message = message
 
 
-def build(ir, trampoline, build_dir, binary_name, build_flags):
-    """Creates out.{ir,S,exe} in build_dir"""
-    with open(os.path.join(build_dir, binary_name + '.ir'), 'w+b') as ir_file:
-        asm = os.path.join(build_dir, binary_name + '.S')
-        exe = os.path.join(build_dir, binary_name)
+def file_digest(*paths):
+    """Returns the SHA-256 hex digest of the contents of paths"""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BinaryCache():
+    """Executables stored by the digest of everything they were built from,
+    so a candidate whose assembly is identical to an earlier one can reuse
+    the earlier executable instead of being compiled again. With max_size,
+    the least recently used executables are removed once the cache holds
+    more than max_size bytes."""
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
 
+    @staticmethod
+    def key(*parts):
+        """Digest of the strings and bytes in parts"""
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            digest.update(hashlib.sha256(part).digest())
+        return digest.hexdigest()
+
+    def fetch(self, key, exe):
+        """Links the executable stored under key to exe. Returns whether
+        there was one."""
+        stored = os.path.join(self.directory, key)
+        try:
+            os.link(stored, exe)
+        except FileNotFoundError:
+            self.misses += 1
+            note('reused_executable', False)
+            return False
+        log.info("Reusing executable built from identical assembly")
+        self.hits += 1
+        # The modification time orders the executables by their last use
+        try:
+            os.utime(stored)
+        except OSError:
+            pass
+        note('reused_executable', True)
+        return True
+
+    def store(self, key, exe):
+        stored = os.path.join(self.directory, key)
+        tmp_name = f"{stored}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            os.link(exe, tmp_name)
+            os.replace(tmp_name, stored)
+        except OSError as e:
+            log.warning(f"Could not store {exe} in the binary cache: {e}")
+            return
+        if self.max_size is not None:
+            self._evict()
+
+    def _evict(self):
+        """Removes the least recently used executables until the others fit
+        in max_size bytes"""
+        entries = list()
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                # Skip the temporary names of executables being stored
+                if '.' in entry.name:
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        total = sum(size for _, _, size in entries)
+        for _, path, size in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Removes the cache directory and everything in it"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def log_info(self):
+        log.info(f"Binary cache: {self.hits}/{self.misses} hits/misses")
+
+
+def serialize(ir, build_dir, binary_name):
+    """Writes ir to build_dir/binary_name.ir and returns the file name"""
+    ir_file_name = os.path.join(build_dir, binary_name + '.ir')
+    with open(ir_file_name, 'w+b') as ir_file, phase('serialize'):
         log.info("Serializing IR")
         ir_file.write(ir.toProtobuf().SerializeToString())
-        ir_file.flush()
+    return ir_file_name
 
-        # Generate assembly
-        log.info("Generating assembly")
-        pprinter_command = ['gtirb-pprinter',
-                            '-i', ir_file.name,
-                            '-o', asm]
-        try:
+
+def pprint(ir_file_name, asm):
+    """Generates the assembly file asm from a serialized IR"""
+    log.info("Generating assembly")
+    pprinter_command = ['gtirb-pprinter',
+                        '-i', ir_file_name,
+                        '-o', asm]
+    try:
+        with phase('pprint'):
             res = subprocess.run(pprinter_command,
                                  stdout=subprocess.DEVNULL,
                                  stderr=subprocess.DEVNULL)
-            if res.returncode != 0:
-                raise AssemblerError(f"Failed to assemble {asm}")
-        except subprocess.SubprocessError:
-            raise AssemblerError(f"Caught exception")
-
-        # Compile
-        build_command = ['gcc', '-no-pie',
-                         asm, trampoline]
-        build_command += build_flags
-        build_command += ['-o', exe]
-        try:
+        if res.returncode != 0:
+            raise AssemblerError(f"Failed to assemble {asm}")
+    except subprocess.SubprocessError:
+        raise AssemblerError(f"Caught exception")
+
+
+def compile_asm(asm, trampoline, exe, build_flags, binary_cache=None):
+    """Assembles and links asm with the trampoline into exe"""
+    if binary_cache is not None:
+        with open(asm, 'rb') as asm_file, \
+                open(trampoline, 'rb') as trampoline_file, \
+                phase('binary_cache'):
+            key = binary_cache.key(asm_file.read(), trampoline_file.read(),
+                                   ' '.join(build_flags))
+        if binary_cache.fetch(key, exe):
+            return
+    build_command = ['gcc', '-no-pie',
+                     asm, trampoline]
+    build_command += build_flags
+    build_command += ['-o', exe]
+    try:
+        with phase('gcc'):
+            res = subprocess.run(build_command,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        if res.returncode != 0:
+            raise CompilerError(f"Failed to build with error:\n"
+                                f"{res.stderr.decode('utf-8').strip()}")
+    except subprocess.SubprocessError:
+        raise CompilerError("Exception while running gcc")
+    if binary_cache is not None:
+        binary_cache.store(key, exe)
+
+
+def assemble_cached(unit, object_dir):
+    """Assembles the assembly text unit into an object file named by the
+    hash of its content in object_dir, unless it already exists. Returns the
+    object file name and whether it was cached."""
+    digest = hashlib.sha256(unit.encode('utf-8')).hexdigest()
+    obj = os.path.join(object_dir, digest + '.o')
+    if os.path.exists(obj):
+        return obj, True
+
+    # Parallel builds may assemble the same unit, so write to a file unique
+    # to this thread and move it into place
+    tmp_name = os.path.join(object_dir, f"{digest}.{os.getpid()}."
+                            f"{threading.get_ident()}")
+    with open(tmp_name + '.S', 'w') as asm_file:
+        asm_file.write(unit)
+    try:
+        with phase('assemble'):
+            res = subprocess.run(['gcc', '-c', tmp_name + '.S',
+                                  '-o', tmp_name + '.o'],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        if res.returncode != 0:
+            raise CompilerError(f"Failed to assemble with error:\n"
+                                f"{res.stderr.decode('utf-8').strip()}")
+        os.replace(tmp_name + '.o', obj)
+    except subprocess.SubprocessError:
+        raise CompilerError("Exception while running gcc")
+    finally:
+        os.remove(tmp_name + '.S')
+    return obj, False
+
+
+def compile_units(units, trampoline_labels, trampoline, exe, build_flags,
+                  object_dir, binary_cache=None):
+    """Assembles every unit that is not in the object cache, then links the
+    objects and the trampoline into exe. trampoline_labels are defined as
+    aliases of the trampoline."""
+    os.makedirs(object_dir, exist_ok=True)
+    with open(trampoline) as trampoline_file:
+        units = list(units) + [trampoline_file.read()]
+    if binary_cache is not None:
+        with phase('binary_cache'):
+            key = binary_cache.key(*units,
+                                   ' '.join(sorted(trampoline_labels)),
+                                   ' '.join(build_flags))
+        if binary_cache.fetch(key, exe):
+            return
+    objects = list()
+    hits = 0
+    for unit in units:
+        obj, cached = assemble_cached(unit, object_dir)
+        objects.append(obj)
+        hits += cached
+    log.info(f"Reused {hits}/{len(units)} objects")
+    note('objects', len(units))
+    note('reused_objects', hits)
+
+    # Pass the aliases through a response file, there can be many of them
+    build_command = ['gcc', '-no-pie'] + objects + build_flags
+    if trampoline_labels:
+        defsym_file = exe + '.defsym'
+        with open(defsym_file, 'w') as f:
+            f.writelines(f"--defsym={label}=__gtirb_trampoline\n"
+                         for label in sorted(trampoline_labels))
+        build_command.append(f"-Wl,@{defsym_file}")
+    build_command += ['-o', exe]
+    log.info("Linking")
+    try:
+        with phase('link'):
             res = subprocess.run(build_command,
                                  stdout=subprocess.PIPE,
                                  stderr=subprocess.PIPE)
-            if res.returncode != 0:
-                raise CompilerError(f"Failed to build with error:\n"
-                                    f"{res.stderr.decode('utf-8').strip()}")
-        except subprocess.SubprocessError:
-            raise CompilerError("Exception while running gcc")
+        if res.returncode != 0:
+            raise CompilerError(f"Failed to link with error:\n"
+                                f"{res.stderr.decode('utf-8').strip()}")
+    except subprocess.SubprocessError:
+        raise CompilerError("Exception while running gcc")
+    if binary_cache is not None:
+        binary_cache.store(key, exe)
+
+
+def build_ir_file(ir_file_name, trampoline, build_dir, binary_name,
+                  build_flags, object_dir=None, binary_cache=None):
+    """Creates binary_name.{S,exe} in build_dir from a serialized IR. With an
+    object_dir, the assembly is built incrementally by compile_units()"""
+    asm = os.path.join(build_dir, binary_name + '.S')
+    exe = os.path.join(build_dir, binary_name)
+    pprint(ir_file_name, asm)
+    if object_dir is None:
+        compile_asm(asm, trampoline, exe, build_flags, binary_cache)
+    else:
+        with open(asm) as asm_file:
+            units, labels = AsmLayout(asm_file.read()).units()
+        compile_units(units, labels, trampoline, exe, build_flags, object_dir,
+                      binary_cache)
+
+
+def build(ir, trampoline, build_dir, binary_name, build_flags):
+    """Creates out.{ir,S,exe} in build_dir"""
+    ir_file_name = serialize(ir, build_dir, binary_name)
+    build_ir_file(ir_file_name, trampoline, build_dir, binary_name,
+                  build_flags)
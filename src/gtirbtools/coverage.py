@@ -0,0 +1,180 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+#
+# Block coverage of the test suite, recorded by an instrumented build of the
+# IR
+#
+import logging as log
+import os
+import re
+
+from gtirb import *
+
+from gtirbtools.build import compile_asm, pprint
+
+COVERAGE = '__gtirb_coverage'
+PAGE_SIZE = 4096
+
+_MARKER = '__gtirb_cov_{:x}'
+_MARKER_LABEL = re.compile(r'^\s*(__gtirb_cov_[0-9a-f]+):')
+# Lines that emit no code: labels, comments and blank lines
+_NO_CODE = re.compile(r'^\s*([A-Za-z_.$][\w.$@]*:\s*)?(#.*)?$')
+
+# Maps the counters to the coverage file when the program starts, so hits
+# are recorded even if it crashes or is killed, and concurrent runs share
+# them. Constructors that run first record hits in memory, which are merged
+# into the file before the mapping replaces them. Only clobbers registers
+# the caller does not expect preserved.
+_RUNTIME = """
+
+#===================================
+.section .rodata
+#===================================
+
+{coverage}_path:
+          .string "{path}"
+
+#===================================
+.section .gtirb_coverage,"aw",@nobits
+.align {page_size}
+#===================================
+
+{coverage}:
+          .skip {size}
+
+#===================================
+.text
+.align 16
+#===================================
+
+{coverage}_init:
+            lea RDI,[RIP+{coverage}_path]
+            mov ESI,2
+            mov EAX,2
+            syscall
+            test EAX,EAX
+            js {coverage}_done
+            mov R8,RAX
+            xor EDI,EDI
+            mov ESI,{size}
+            mov EDX,3
+            mov R10D,1
+            xor R9D,R9D
+            mov EAX,9
+            syscall
+            cmp RAX,-4095
+            jae {coverage}_close
+            lea RSI,[RIP+{coverage}]
+            xor ECX,ECX
+{coverage}_merge:
+            cmp BYTE PTR [RSI+RCX],0
+            je {coverage}_next
+            mov BYTE PTR [RAX+RCX],1
+{coverage}_next:
+            inc RCX
+            cmp RCX,{size}
+            jb {coverage}_merge
+            mov RDI,RAX
+            mov ESI,{size}
+            mov EAX,11
+            syscall
+            lea RDI,[RIP+{coverage}]
+            mov ESI,{size}
+            mov EDX,3
+            mov R10D,17
+            xor R9D,R9D
+            mov EAX,9
+            syscall
+{coverage}_close:
+            mov RDI,R8
+            mov EAX,3
+            syscall
+{coverage}_done:
+            ret
+
+#===================================
+.section .init_array,"aw"
+.align 8
+#===================================
+
+          .quad {coverage}_init
+"""
+
+
+def _counters_size(count):
+    """Size of the counters of count blocks, in whole pages so that they can
+    be mapped to the coverage file"""
+    return max(1, -(-count // PAGE_SIZE)) * PAGE_SIZE
+
+
+def add_markers(ir, factory, journal=None):
+    """Adds a symbol referring to every block, so that gtirb-pprinter labels
+    the start of every block. Returns a mapping from marker names to block
+    addresses."""
+    markers = dict()
+    for module in ir._modules:
+        symbols = module._symbols
+        module._symbols = list(symbols)
+        if journal is not None:
+            journal.record(lambda module=module, symbols=symbols:
+                           setattr(module, '_symbols', symbols))
+        for block in module._blocks:
+            if not hasattr(block, '_address'):
+                continue
+            name = _MARKER.format(block._address)
+            module._symbols.append(Symbol(factory=factory, name=name,
+                                          referent=block))
+            markers[name] = block._address
+    return markers
+
+
+def instrument_asm(asm, markers, coverage_file):
+    """Records a hit at every marker label of asm, after the other labels of
+    the block so that jumps to any of them record it. Returns the
+    instrumented assembly and the addresses of the blocks, in the order of
+    their counters in coverage_file."""
+    blocks = list()
+    lines = list()
+    # Hits to record before the next line that emits code
+    pending = list()
+    for line in asm.splitlines(keepends=True):
+        if pending and not _NO_CODE.match(line):
+            lines.extend(pending)
+            pending.clear()
+        lines.append(line)
+        match = _MARKER_LABEL.match(line)
+        if match and match.group(1) in markers:
+            pending.append(f"            mov BYTE PTR "
+                           f"[RIP+{COVERAGE}+{len(blocks)}],1\n")
+            blocks.append(markers[match.group(1)])
+    lines.extend(pending)
+    lines.append(_RUNTIME.format(coverage=COVERAGE, path=coverage_file,
+                                 page_size=PAGE_SIZE,
+                                 size=_counters_size(len(blocks))))
+    return ''.join(lines), blocks
+
+
+def build_instrumented(ir_file_name, markers, trampoline, build_dir,
+                       binary_name, build_flags):
+    """Builds the IR, which has markers added by add_markers(), into an
+    executable that records the blocks it executes. Returns the executable,
+    the coverage file and the addresses of the instrumented blocks."""
+    base = os.path.join(build_dir, binary_name)
+    pprint(ir_file_name, base + '.S')
+    coverage_file = os.path.abspath(base + '.coverage')
+    with open(base + '.S') as asm_file:
+        asm, blocks = instrument_asm(asm_file.read(), markers, coverage_file)
+    log.info(f"Instrumented {len(blocks)} of {len(markers)} blocks")
+    with open(base + '-coverage.S', 'w') as asm_file:
+        asm_file.write(asm)
+    compile_asm(base + '-coverage.S', trampoline, base, build_flags)
+    with open(coverage_file, 'wb') as f:
+        f.truncate(_counters_size(len(blocks)))
+    return base, coverage_file, blocks
+
+
+def executed_blocks(coverage_file, blocks):
+    """Returns the set of addresses of the blocks recorded as executed in
+    coverage_file"""
+    with open(coverage_file, 'rb') as f:
+        hits = f.read(len(blocks))
+    return {address for address, hit in zip(blocks, hits) if hit}
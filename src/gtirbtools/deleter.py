@@ -1,6 +1,7 @@
 # Copyright (C) 2020 GrammaTech, Inc.
+from contextlib import contextmanager
+import hashlib
 import logging as log
-import pickle
 import tempfile
 import shutil
 import subprocess
@@ -10,8 +11,13 @@ import os
 from gtirb import *
 
 import gtirbtools.info as info
-from gtirbtools.modify import remove_blocks, remove_functions
-from gtirbtools.build import build, BuildError
+from gtirbtools.modify import (Journal, index_modules, remove_blocks,
+                               remove_functions)
+from gtirbtools.build import (build, compile_asm, compile_units,
+                              file_digest, pprint, serialize, BuildError)
+from gtirbtools.coverage import add_markers, build_instrumented
+from gtirbtools.splice import AsmLayout
+from gtirbtools.timing import phase
 
 
 class DeleterError(Exception):
@@ -25,15 +31,17 @@ class IRFileNotFound(DeleterError):
 
 
 class IRGenerationError(DeleterError):
-    def __init__(self, dir_name):
+    def __init__(self, test_dir):
         log.error(f"Could not generate IR")
-        self.dir_name = dir_name
+        self.test_dir = test_dir
+        self.dir_name = test_dir.name
 
 
 class Deleter():
     """Base class for deletion of code in GTIRB"""
     def __init__(self, infile, trampoline, workdir,
-                 binary_name, build_flags=[]):
+                 binary_name, build_flags=[], incremental=False,
+                 binary_cache=None):
         if not os.path.exists(infile):
             raise IRFileNotFound(infile)
         self.infile = infile
@@ -41,10 +49,19 @@ class Deleter():
         self.workdir = workdir
         self.binary_name = binary_name
         self.build_flags = build_flags
+        # Objects assembled by incremental builds, shared by all candidates
+        self.object_dir = None
+        if incremental:
+            self.object_dir = os.path.join(workdir, 'objects')
+        self.binary_cache = binary_cache
         self._ir_loader = IRLoader()
         self._ir = self._ir_loader.IRLoadFromProtobufFileName(self.infile)
         self._factory = self._ir_loader._factory
+        # Deletions are always rolled back, so the index stays valid
+        self._index = index_modules(self._ir)
         self._original_size = None
+        # Items deleted from the IR for good, see prune()
+        self.pruned = list()
 
     @property
     def original_size(self):
@@ -59,50 +76,378 @@ class Deleter():
             self._original_size = size
         return self._original_size
 
-    def _delete(self, ir, items):
-        """Override in subclasses"""
+    def digest(self):
+        """Returns a digest identifying the input IR, trampoline, build
+        setup and kind of items deleted"""
+        digest = hashlib.sha256()
+        inputs = file_digest(self.infile, self.trampoline)
+        digest.update(inputs.encode('utf-8'))
+        digest.update(' '.join([type(self).__name__, self.binary_name]
+                               + self.build_flags).encode('utf-8'))
+        digest.update(' '.join(sorted(str(i) for i in self.pruned))
+                      .encode('utf-8'))
+        return digest.hexdigest()
+
+    def item_graph(self):
+        """Returns a mapping from every item to the set of items it depends
+        on or is depended on by. Override in subclasses."""
+        return {item: set() for item in self.items}
+
+    def item_predecessors(self):
+        """Returns a mapping from items that can only be reached through
+        other items to the set of those items. Items that can be reached in
+        other ways are left out. Override in subclasses."""
+        return dict()
+
+    def unexecuted(self, blocks):
+        """Returns the items all of whose blocks are in blocks, a set of
+        addresses of blocks that never executed. Override in subclasses."""
         raise NotImplementedError
 
-    def delete(self, items, name):
-        # I (Jeremy) profiled pickle.loads(pickle.dumps()) and copy.deepcopy()
-        # and found that the pickle/unpickle method is about 5x faster. I think
-        # this is because deepcopy() has a lot of bookkeeping for corner cases.
-        log.info("Copying IR")
-        ir = pickle.loads(pickle.dumps(self._ir))
+    def prune(self, items):
+        """Deletes items from the IR for good and stops offering them as
+        items. The original size is still that of the unmodified IR."""
+        self.original_size
+        self._delete(self._ir, items, None)
+        self._index = index_modules(self._ir)
+        pruned = set(items)
+        self.pruned += items
+        self.items = [x for x in self.items if x not in pruned]
+
+    def instrument(self, build_dir):
+        """Builds the program in build_dir with every block recording when it
+        executes. Returns the executable, the coverage file and the addresses
+        of the instrumented blocks (see gtirbtools.coverage)."""
+        journal = Journal()
+        try:
+            markers = add_markers(self._ir, self._factory, journal)
+            ir_file_name = serialize(self._ir, build_dir, self.binary_name)
+        finally:
+            journal.rollback()
+        return build_instrumented(ir_file_name, markers, self.trampoline,
+                                  build_dir, self.binary_name,
+                                  self.build_flags)
 
-        # Generate new IR
-        self._delete(ir, items)
+    def _delete(self, ir, items, journal):
+        """Override in subclasses"""
+        raise NotImplementedError
 
-        # Output to a GTIRB file
+    def _make_test_dir(self, items, name):
         cur_dir = tempfile.TemporaryDirectory(prefix=name, dir=self.workdir)
         with open(os.path.join(cur_dir.name, 'deleted.txt'), 'w+') as listfile:
             listfile.write(' '.join(sorted([str(i) for i in items])) + "\n")
+        return cur_dir
+
+    @contextmanager
+    def _build_errors(self, cur_dir):
         try:
-            build(ir, self.trampoline, cur_dir.name,
-                  self.binary_name, self.build_flags)
+            yield
         except BuildError as e:
             log.info(e.message)
-            raise IRGenerationError(cur_dir.name)
+            raise IRGenerationError(cur_dir)
+
+    # Candidates are built in three stages, which can run concurrently for
+    # different candidates, except for generate() which modifies the IR.
+    def generate(self, items, name, verify=False):
+        """Creates a new temporary directory holding the IR with items
+        deleted, and returns it"""
+        # Rather than deleting from a copy of the IR, delete from the IR
+        # itself while journaling every change, and roll the changes back
+        # once the result is serialized. This keeps the cost per candidate
+        # proportional to the number of deleted items.
+        cur_dir = self._make_test_dir(items, name)
+
+        # Generate new IR and output it to a GTIRB file
+        journal = Journal()
+        try:
+            with phase('delete'):
+                self._delete(self._ir, items, journal)
+            serialize(self._ir, cur_dir.name, self.binary_name)
+        finally:
+            with phase('rollback'):
+                journal.rollback()
+        return cur_dir
+
+    def print_assembly(self, cur_dir, items, verify=False):
+        """Generates the assembly in cur_dir"""
+        base = os.path.join(cur_dir.name, self.binary_name)
+        with self._build_errors(cur_dir):
+            pprint(base + '.ir', base + '.S')
+
+    def compile(self, cur_dir, items, verify=False):
+        """Builds the executable in cur_dir from the assembly"""
+        base = os.path.join(cur_dir.name, self.binary_name)
+        with self._build_errors(cur_dir):
+            if self.object_dir is None:
+                compile_asm(base + '.S', self.trampoline, base,
+                            self.build_flags, self.binary_cache)
+            else:
+                with open(base + '.S') as asm_file, phase('splice'):
+                    units, labels = AsmLayout(asm_file.read()).units()
+                compile_units(units, labels, self.trampoline, base,
+                              self.build_flags, self.object_dir,
+                              self.binary_cache)
+
+    def save_ir(self, items, build_dir):
+        """Serializes the IR with items deleted to build_dir, returns the IR
+        file name"""
+        journal = Journal()
+        try:
+            self._delete(self._ir, items, journal)
+            return serialize(self._ir, build_dir, self.binary_name)
+        finally:
+            journal.rollback()
+
+    def delete(self, items, name, verify=False):
+        """Builds the program with items deleted in a new temporary directory
+        and returns it. verify requests the IR-based path for deleters that
+        have a faster, approximate one."""
+        cur_dir = self.generate(items, name, verify)
+        self.print_assembly(cur_dir, items, verify)
+        self.compile(cur_dir, items, verify)
         return cur_dir
 
 
 class BlockDeleter(Deleter):
-    def __init__(self, infile, trampoline, workdir, binary_name, build_flags):
-        super().__init__(infile, trampoline, workdir, binary_name, build_flags)
-        self.blocks = info.block_addresses(self._ir)
+    """Deletes basic blocks. If functions is given, only the blocks of the
+    functions with these names are items."""
+    def __init__(self, infile, trampoline, workdir, binary_name, build_flags,
+                 incremental=False, binary_cache=None, functions=None):
+        super().__init__(infile, trampoline, workdir, binary_name, build_flags,
+                         incremental, binary_cache)
+        self.functions = functions
+        if functions is None:
+            self.blocks = info.block_addresses(self._ir)
+        else:
+            function_index = info.FunctionIndex(self._ir)
+            blocks = set()
+            for name in functions:
+                blocks |= function_index.block_addresses(name)
+            self.blocks = sorted(blocks)
         self.items = self.blocks
 
-    def _delete(self, ir, blocks):
+    def item_graph(self):
+        items = set(self.items)
+        return {b: neighbours & items
+                for b, neighbours in info.block_graph(self._ir).items()
+                if b in items}
+
+    def item_predecessors(self):
+        # Blocks with a symbol or symbolic operand referring to them, and
+        # function entries, can be reached without a CFG edge
+        items = set(self.items)
+        predecessors = dict()
+        for module_index in self._index:
+            for address in items & module_index.blocks_by_addr.keys():
+                block = module_index.blocks_by_addr[address]
+                if (block in module_index.symbols or
+                        block in module_index.redirect_keys or
+                        block in module_index.delete_keys or
+                        block._uuid in module_index.function_entries):
+                    continue
+                sources = {getattr(edge.source(), '_address', None)
+                           for edge in module_index.edges.get(block, ())
+                           if edge.target() is block}
+                sources.discard(address)
+                if sources and sources <= items:
+                    predecessors[address] = sources
+        return predecessors
+
+    def unexecuted(self, blocks):
+        return [b for b in self.items if b in blocks]
+
+    def function_hierarchy(self):
+        """Returns info.function_hierarchy() of the IR, limited to the
+        blocks that are items"""
+        items = set(self.items)
+        hierarchy = list()
+        for functions in info.function_hierarchy(self._ir):
+            functions = {name: [b for b in blocks if b in items]
+                         for name, blocks in functions.items()}
+            hierarchy.append({name: blocks
+                              for name, blocks in functions.items()
+                              if blocks})
+        return hierarchy
+
+    def digest(self):
+        if self.functions is None:
+            return super().digest()
+        digest = hashlib.sha256(super().digest().encode('utf-8'))
+        digest.update(' '.join(sorted(self.functions)).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _delete(self, ir, blocks, journal):
         log.info("Deleting blocks")
-        remove_blocks(ir, self._factory, blocks)
+        remove_blocks(ir, self._factory, blocks, journal, self._index)
 
 
 class FunctionDeleter(Deleter):
-    def __init__(self, infile, trampoline, workdir, binary_name, build_flags):
-        super().__init__(infile, trampoline, workdir, binary_name, build_flags)
-        self.functions = list(info.get_function_map(self._ir).keys())
+    def __init__(self, infile, trampoline, workdir, binary_name, build_flags,
+                 incremental=False, binary_cache=None):
+        super().__init__(infile, trampoline, workdir, binary_name, build_flags,
+                         incremental, binary_cache)
+        self._function_index = info.FunctionIndex(self._ir)
+        self.functions = list(self._function_index.functions.keys())
         self.items = self.functions
 
-    def _delete(self, ir, functions):
+    def item_graph(self):
+        # Functions depend on each other through the CFG edges (calls,
+        # tail calls and fallthroughs) between their blocks
+        index = self._function_index
+        graph = {f: set() for f in self.items}
+        # Function UUID -> names of the function that are items
+        names = dict()
+        for name in graph:
+            names.setdefault(index.uuid(name), set()).add(name)
+        for aliases in names.values():
+            for name in aliases:
+                graph[name] |= aliases - {name}
+        for b, neighbours in info.block_graph(self._ir).items():
+            sources = names.get(index.function_at(b), ())
+            targets = set()
+            for n in neighbours:
+                targets |= names.get(index.function_at(n), set())
+            for source in sources:
+                graph[source] |= targets - {source}
+                for target in targets - {source}:
+                    graph[target].add(source)
+        return graph
+
+    def unexecuted(self, blocks):
+        return [f for f in self.items
+                if self._function_index.block_addresses(f) <= blocks]
+
+    def surviving(self, deleted):
+        """Returns the names of the functions that remain once the functions
+        named in deleted are deleted. Deleting a function by one of its
+        names deletes it under all of them."""
+        index = self._function_index
+        gone = {index.uuid(f) for f in deleted}
+        return [f for f in self.functions if index.uuid(f) not in gone]
+
+    def _delete(self, ir, functions, journal):
         log.info("Deleting functions")
-        remove_functions(ir, self._factory, functions)
+        remove_functions(ir, self._factory, functions, journal, self._index,
+                         self._function_index)
+
+
+class AsmFunctionDeleter(FunctionDeleter):
+    """Deletes functions by splicing them out of the assembly of the original
+    IR, which is only printed once. Candidates skip IR modification,
+    serialization and gtirb-pprinter; the IR-based path is only used when
+    verifying a result."""
+    def __init__(self, infile, trampoline, workdir, binary_name, build_flags,
+                 incremental=False, binary_cache=None):
+        super().__init__(infile, trampoline, workdir, binary_name, build_flags,
+                         incremental, binary_cache)
+        self._original_dir = tempfile.TemporaryDirectory(prefix='original-',
+                                                         dir=self.workdir)
+        ir_file_name = serialize(self._ir, self._original_dir.name,
+                                 self.binary_name)
+        asm = os.path.join(self._original_dir.name, self.binary_name + '.S')
+        pprint(ir_file_name, asm)
+        with open(asm) as asm_file:
+            self._layout = AsmLayout(asm_file.read())
+
+    def generate(self, items, name, verify=False):
+        if verify:
+            return super().generate(items, name)
+
+        cur_dir = self._make_test_dir(items, name)
+        if self.object_dir is None:
+            log.info("Splicing assembly")
+            asm = os.path.join(cur_dir.name, self.binary_name + '.S')
+            with open(asm, 'w') as asm_file, phase('splice'):
+                asm_file.write(self._layout.render(self.pruned + list(items)))
+        return cur_dir
+
+    def print_assembly(self, cur_dir, items, verify=False):
+        if verify:
+            super().print_assembly(cur_dir, items)
+
+    def compile(self, cur_dir, items, verify=False):
+        if verify or self.object_dir is None:
+            return super().compile(cur_dir, items)
+
+        exe = os.path.join(cur_dir.name, self.binary_name)
+        with self._build_errors(cur_dir):
+            with phase('splice'):
+                units, labels = self._layout.units(self.pruned + list(items))
+            compile_units(units, labels, self.trampoline, exe,
+                          self.build_flags, self.object_dir,
+                          self.binary_cache)
+
+
+class GroupDeleter():
+    """Presents groups of the items of another deleter as items. Deleting a
+    group deletes all of its items, on top of the items that are always
+    deleted. Everything else is delegated to the other deleter."""
+    def __init__(self, deleter, groups, deleted=()):
+        self.deleter = deleter
+        # Group -> items of the deleter
+        self.groups = groups
+        self.deleted = list(deleted)
+        self.items = list(groups)
+
+    def __getattr__(self, name):
+        return getattr(self.deleter, name)
+
+    def expand(self, groups):
+        """Returns the items of the deleter that deleting groups deletes"""
+        items = list(self.deleted)
+        for group in groups:
+            items += self.groups[group]
+        return items
+
+    def digest(self):
+        digest = hashlib.sha256(self.deleter.digest().encode('utf-8'))
+        for group, items in sorted(self.groups.items(),
+                                   key=lambda g: str(g[0])):
+            digest.update(f"{group}: {' '.join(map(str, items))}\n"
+                          .encode('utf-8'))
+        digest.update(' '.join(sorted(map(str, self.deleted)))
+                      .encode('utf-8'))
+        return digest.hexdigest()
+
+    def item_graph(self):
+        group_of = {x: group for group, items in self.groups.items()
+                    for x in items}
+        graph = {group: set() for group in self.groups}
+        for x, neighbours in self.deleter.item_graph().items():
+            if x not in group_of:
+                continue
+            for n in neighbours:
+                if n in group_of and group_of[n] != group_of[x]:
+                    graph[group_of[x]].add(group_of[n])
+        return graph
+
+    def item_predecessors(self):
+        # Only single items keep the dependencies of the deleter
+        single = {items[0]: group for group, items in self.groups.items()
+                  if len(items) == 1}
+        if len(single) != len(self.groups):
+            return dict()
+        return {single[x]: {single[p] for p in predecessors}
+                for x, predecessors in
+                self.deleter.item_predecessors().items()
+                if x in single and predecessors <= single.keys()}
+
+    def unexecuted(self, blocks):
+        unexecuted = set(self.deleter.unexecuted(blocks))
+        return [group for group, items in self.groups.items()
+                if unexecuted.issuperset(items)]
+
+    def generate(self, items, name, verify=False):
+        return self.deleter.generate(self.expand(items), name, verify)
+
+    def print_assembly(self, cur_dir, items, verify=False):
+        self.deleter.print_assembly(cur_dir, self.expand(items), verify)
+
+    def compile(self, cur_dir, items, verify=False):
+        self.deleter.compile(cur_dir, self.expand(items), verify)
+
+    def save_ir(self, items, build_dir):
+        return self.deleter.save_ir(self.expand(items), build_dir)
+
+    def delete(self, items, name, verify=False):
+        return self.deleter.delete(self.expand(items), name, verify)
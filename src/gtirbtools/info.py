@@ -10,39 +10,100 @@ def block_addresses(ir):
     return blocks
 
 
+def block_graph(ir):
+    """Returns a mapping from every block address to the set of addresses of
+    the blocks it shares a CFG edge with, in either direction"""
+    graph = dict()
+    for module in ir._modules:
+        for b in module._blocks:
+            if hasattr(b, '_address'):
+                graph.setdefault(b._address, set())
+        for edge in module._cfg._edges:
+            source, target = edge.source(), edge.target()
+            if not (hasattr(source, '_address') and
+                    hasattr(target, '_address')):
+                continue
+            if source._address != target._address:
+                graph[source._address].add(target._address)
+                graph[target._address].add(source._address)
+    return graph
+
+
+class FunctionIndex():
+    """Function lookups for an IR, built once so that each lookup is O(1)"""
+    def __init__(self, ir):
+        # Symbol Name -> Function UUID
+        self.functions = dict()
+        # Function UUID -> set of block addresses
+        self.function_blocks = dict()
+        # Block Address -> Function UUID
+        self.block_functions = dict()
+        for module in ir.modules():
+            # Entry block UUID -> Function UUID
+            entry_functions = dict()
+            for function_uuid, entry_block_uuids in \
+                    module.auxData('functionEntries').items():
+                for block_uuid in entry_block_uuids:
+                    entry_functions.setdefault(block_uuid, function_uuid)
+            for symbol in module.symbols():
+                if isinstance(symbol.referent(), Block):
+                    function_uuid = entry_functions.get(
+                        symbol.referent().uuid())
+                    if function_uuid is not None:
+                        self.functions[symbol.name()] = function_uuid
+
+            # Block UUID -> Block Address
+            block_uuid_map = {b.uuid(): b.address() for b in module.blocks()
+                              if hasattr(b, '_address')}
+            for function_uuid, block_uuids in \
+                    module.auxData('functionBlocks').items():
+                addresses = self.function_blocks.setdefault(function_uuid,
+                                                            set())
+                for block_uuid in block_uuids:
+                    address = block_uuid_map.get(block_uuid)
+                    if address is not None:
+                        addresses.add(address)
+                        self.block_functions[address] = function_uuid
+
+    def uuid(self, function_name):
+        """Returns the UUID of the function named function_name"""
+        return self.functions[function_name]
+
+    def block_addresses(self, function_name):
+        """Returns the set of block addresses of the function named
+        function_name"""
+        return self.function_blocks.get(self.functions[function_name], set())
+
+    def function_at(self, address):
+        """Returns the UUID of the function containing the block at address,
+        or None"""
+        return self.block_functions.get(address)
+
+
+def function_hierarchy(ir):
+    """Returns the functions and blocks of every module of ir, as a list of
+    mappings from function names to lists of block addresses, one per
+    module. Functions are named by their first symbol in alphabetical order,
+    or their UUID if they have none. Blocks outside functions are listed
+    under None."""
+    index = FunctionIndex(ir)
+    names = dict()
+    for name, uuid in index.functions.items():
+        if uuid not in names or name < names[uuid]:
+            names[uuid] = name
+    hierarchy = list()
+    for module in ir._modules:
+        functions = dict()
+        for b in module._blocks:
+            if not hasattr(b, '_address'):
+                continue
+            uuid = index.function_at(b._address)
+            name = names.get(uuid, None if uuid is None else str(uuid))
+            functions.setdefault(name, list()).append(b._address)
+        hierarchy.append(functions)
+    return hierarchy
+
+
 def get_function_map(ir):
     """Returns a mapping from function (symbol) names to function UUIDs"""
-    # Symbol Name -> Function UUID
-    functions = dict()
-    for module in ir.modules():
-        # Function UUID -> set of entry block UUIDs
-        function_entries = module.auxData('functionEntries')
-        # Symbol Name -> Block UUID
-        block_symbols = {s.name(): s.referent().uuid()
-                         for s in module.symbols()
-                         if isinstance(s.referent(), Block)}
-        for symbol_name, block_uuid in block_symbols.items():
-            for function_uuid, entry_block_uuids in function_entries.items():
-                if block_uuid in entry_block_uuids:
-                    functions[symbol_name] = function_uuid
-                    break
-    return functions
-
-
-def get_function_block_addresses(function_name, functions, ir):
-    """Returns the set of block addresses corresponding to the function
-    with name function_name, given a mapping from function (symbol) names
-    to function UUIDs"""
-    function_uuid = functions[function_name]
-    # Block UUID -> Block Address
-    block_uuid_map = dict()
-    for module in ir.modules():
-        block_uuid_map.update({b.uuid(): b.address() for b in module.blocks()
-                               if hasattr(b, '_address')})
-
-    function_block_uuids = set()
-    for module in ir.modules():
-        # Function UUID -> set of block UUIDs in the function
-        function_blocks = module.auxData('functionBlocks')
-        function_block_uuids.update(function_blocks.get(function_uuid))
-    return {block_uuid_map[uuid] for uuid in function_block_uuids}
+    return FunctionIndex(ir).functions
@@ -6,153 +6,238 @@ import logging as log
 
 from gtirb import *
 
-from gtirbtools.info import get_function_map, get_function_block_addresses
-
-def _add_edge(graph, source, target, edge):
-    source_entry = graph.get(source)
-    if source_entry is not None:
-        if target in source_entry['to']:
-            source_entry['to'][target].add(edge)
-        else:
-            source_entry['to'][target] = set([edge])
-    else:
-        graph[source] = {
-            'from': dict(),
-            'to': {target: set([edge])}
-        }
-    target_entry = graph.get(target)
-    if target_entry is not None:
-        if source in target_entry['from']:
-            target_entry['from'][source].add(edge)
-        else:
-            target_entry['from'][source] = set([edge])
-    else:
-        graph[target] = {
-            'from': {source: set([edge])},
-            'to': dict()
-        }
-
-
-def _remove_node(graph, target_node):
-    out_edges = list()
-    connections = graph.get(target_node)
-    if connections is None:
-        return out_edges
-
-    def delete_edges(direction, out_edges):
-        for node, edges in connections[direction].items():
-            out_edges += edges
+from gtirbtools.info import FunctionIndex
+
+
+class Journal():
+    """Undo log of modifications made to an IR in place"""
+    def __init__(self):
+        self._undo = list()
+
+    def record(self, undo):
+        """Records a function that reverts the last modification"""
+        self._undo.append(undo)
+
+    def rollback(self):
+        """Reverts every recorded modification, newest first"""
+        log.debug(f"Rolling back {len(self._undo)} modifications")
+        while self._undo:
+            self._undo.pop()()
+
+
+def _positions(container):
+    """Maps the id() of every element of a list to its position, returns None
+    for sets, which need no positions"""
+    if isinstance(container, set):
+        return None
+    return {id(x): i for i, x in enumerate(container)}
+
+
+def _remove_in_place(container, removed, positions, record):
+    """Removes the elements removed from container, a set or a list, and
+    records how to put them back. positions are the _positions() of the
+    unmodified container. Only the removed elements are recorded, a set
+    costs O(len(removed)) and a list is spliced around their positions."""
+    if not removed:
+        return
+    if positions is None:
+        container.difference_update(removed)
+        record(lambda: container.update(removed))
+        return
+
+    removed = sorted(removed, key=lambda x: positions[id(x)])
+    kept = list()
+    start = 0
+    for x in removed:
+        position = positions[id(x)]
+        kept.extend(container[start:position])
+        start = position + 1
+    kept.extend(container[start:])
+    container[:] = kept
+
+    def restore():
+        merged = list()
+        start = 0
+        for x in removed:
+            count = positions[id(x)] - len(merged)
+            merged.extend(container[start:start + count])
+            start += count
+            merged.append(x)
+        merged.extend(container[start:])
+        container[:] = merged
+    record(restore)
+
+
+class ModuleIndex():
+    """Maps each block of a module to everything that must be updated when
+    the block is deleted: its CFG edges, the symbols referring to it, the
+    keys of symbolic operands referring to it and the functionBlocks and
+    functionEntries AuxData entries containing it.
+
+    The index stays valid as long as the module is not modified, or every
+    modification is rolled back with a Journal."""
+    def __init__(self, module):
+        self.module = module
+        self.blocks_by_addr = {b._address: b for b in module._blocks
+                               if hasattr(b, '_address')}
+        # Positions of the blocks, edges and symbols in their containers
+        self.block_positions = _positions(module._blocks)
+        self.edge_positions = _positions(module._cfg._edges)
+        self.symbol_positions = _positions(module._symbols)
+
+        log.debug("Indexing CFG edges")
+        self.edges = dict()
+        for edge in module._cfg._edges:
+            self.edges.setdefault(edge.source(), list()).append(edge)
+            self.edges.setdefault(edge.target(), list()).append(edge)
+
+        log.debug("Indexing symbols")
+        self.symbols = dict()
+        for symbol in module._symbols:
+            block = symbol.referent()
+            if isinstance(block, Block):
+                self.symbols.setdefault(block, list()).append(symbol)
+
+        log.debug("Indexing symbolic operands")
+        # Block -> keys of SymAddrConst operands to redirect
+        self.redirect_keys = dict()
+        # Block -> keys of SymAddrAddr operands to delete
+        self.delete_keys = dict()
+        for key, op in module._symbolic_operands.items():
             try:
-                del graph[node][direction][target_node]
+                if isinstance(op, SymAddrConst):
+                    self.redirect_keys.setdefault(
+                        op.symbol().referent(), list()).append(key)
+                elif isinstance(op, SymAddrAddr):
+                    for symbol in (op._symbol1, op._symbol2):
+                        self.delete_keys.setdefault(
+                            symbol.referent(), list()).append(key)
             except Exception:
                 pass
-        return out_edges
-
-    for direction in ['to', 'from']:
-        out_edges += delete_edges(direction, out_edges)
-
-    del graph[target_node]
-    return out_edges
-
 
-def remove_blocks(ir, factory, block_addresses=list()):
-    for module in ir._modules:
-        blocks_by_addr = dict()
+        log.debug("Indexing function AuxData")
+        # Block UUID -> function UUIDs
+        self.function_blocks = dict()
+        for function, blocks in module.auxData('functionBlocks').items():
+            for uuid in blocks:
+                self.function_blocks.setdefault(uuid, list()).append(function)
+        self.function_entries = dict()
+        for function, blocks in module.auxData('functionEntries').items():
+            for uuid in blocks:
+                self.function_entries.setdefault(uuid,
+                                                 list()).append(function)
+
+
+def index_modules(ir):
+    """Returns a ModuleIndex for every module of ir"""
+    return [ModuleIndex(module) for module in ir._modules]
+
+
+def remove_blocks(ir, factory, block_addresses=list(), journal=None,
+                  index=None):
+    """Removes the blocks at block_addresses and points references to them
+    at __gtirb_trampoline. If a journal is given, the IR is modified in place
+    and every change is recorded so it can be rolled back. Passing the
+    index_modules() of the unmodified IR avoids rebuilding it."""
+    def record(undo):
+        if journal is not None:
+            journal.record(undo)
+
+    if index is None:
+        index = index_modules(ir)
+    for module_index in index:
+        module = module_index.module
         cfg = module._cfg
         extern_trampoline = Symbol(factory=factory,
                                    name='__gtirb_trampoline',
                                    storage_kind=StorageKind.Extern)
-        module._symbols.append(extern_trampoline)
 
-        graph = dict()
-        for block in module._blocks:
-            if hasattr(block, '_address'):
-                blocks_by_addr[block._address] = block
-
-        # Add CFG edges to graph
-        log.debug("Building graph")
-        for edge in cfg._edges:
-            _add_edge(graph, edge.source(), edge.target(), edge)
-
-        # Using sets instead of a lists here greatly speeds up the
-        # `if x in` checks
-        edges_removed = set()
         blocks_removed = set()
         log.debug("Removing blocks "
                   f"{' '.join([f'{b:x}' for b in block_addresses])}")
-
-        # Remove nodes from the graph, returned list of edges correspond to the
-        # edges that must be deleted from the IR
         for b in block_addresses:
-            if b not in blocks_by_addr:
+            if b not in module_index.blocks_by_addr:
                 log.warning(f"No block with address {b:x} found")
                 continue
-            blocks_removed.add(blocks_by_addr[b])
-            edges_removed.update(set(_remove_node(graph, blocks_by_addr[b])))
-
-        # Collects the symbols that refer to removed blocks so the symbols can
-        # also be removed
-        log.debug("Collecting symbols to remove")
-        symbols_to_remove = list()
-        for symbol in module.symbols():
-            block = symbol.referent()
-            if isinstance(block, Block) and block in blocks_removed:
-                symbols_to_remove.append(symbol)
+            blocks_removed.add(module_index.blocks_by_addr[b])
 
+        # Collect everything attached to the removed blocks from the index
+        edges_removed = set()
+        # id() -> symbol
+        symbols_removed = dict()
+        redirect_keys = set()
+        delete_keys = set()
+        for block in blocks_removed:
+            edges_removed.update(module_index.edges.get(block, ()))
+            symbols_removed.update(
+                (id(s), s) for s in module_index.symbols.get(block, ()))
+            redirect_keys.update(module_index.redirect_keys.get(block, ()))
+            delete_keys.update(module_index.delete_keys.get(block, ()))
+
+        # Remove the symbols referring to removed blocks and add the
+        # trampoline
         log.debug("Removing symbols")
-        for symbol in symbols_to_remove:
-            module._symbols.remove(symbol)
+        symbols = module._symbols
+        _remove_in_place(symbols, list(symbols_removed.values()),
+                         module_index.symbol_positions, record)
+        symbols.append(extern_trampoline)
+        record(symbols.pop)
 
         # Remove symbol references to the block addresses and replace them with
         # a call to the trampoline symbol
         log.debug("Pointing stale references to trampoline")
-        keys_to_delete = set()
-        for key, op in module._symbolic_operands.items():
-            try:
-                if (isinstance(op, SymAddrConst) and
-                        op.symbol().referent() in blocks_removed):
-                    op.setSymbol(extern_trampoline)
-                elif (isinstance(op, SymAddrAddr) and
-                      (op._symbol1.referent() in blocks_removed or
-                       op._symbol2.referent() in blocks_removed)):
-                    keys_to_delete.add(key)
-            except Exception:
-                pass
-        for key in keys_to_delete:
-            del module._symbolic_operands[key]
+        operands = module._symbolic_operands
+        for key in delete_keys:
+            record(lambda key=key, op=operands[key]:
+                   operands.__setitem__(key, op))
+            del operands[key]
+        for key in redirect_keys - delete_keys:
+            op = operands[key]
+            record(lambda op=op, symbol=op.symbol(): op.setSymbol(symbol))
+            op.setSymbol(extern_trampoline)
 
         log.debug("Deleting blocks from GTIRB")
-        module.removeBlocks(blocks_removed)
+        _remove_in_place(module._blocks, list(blocks_removed),
+                         module_index.block_positions, record)
         log.debug("Deleting edges from GTIRB CFG")
-        cfg.removeEdges(edges_removed)
-        log.debug("Deleting functionBlock info from AuxData")
-        uuids = {b._uuid for b in blocks_removed}
+        _remove_in_place(cfg._edges, list(edges_removed),
+                         module_index.edge_positions, record)
+
+        log.debug("Deleting functionBlock and functionEntries info "
+                  "from AuxData")
         function_blocks = module.auxData('functionBlocks')
-        for value in function_blocks.values():
-            value.difference_update(uuids)
-        log.debug("Deleting functionEntries info from AuxData")
         function_entries = module.auxData('functionEntries')
-        keys_to_delete = set()
-        for key, value in function_entries.items():
-            value.difference_update(uuids)
-            if len(value) == 0:
-                keys_to_delete.add(key)
-
-        for key in keys_to_delete:
+        touched_entries = set()
+        for block in blocks_removed:
+            uuid = block._uuid
+            for function in module_index.function_blocks.get(uuid, ()):
+                value = function_blocks[function]
+                value.discard(uuid)
+                record(lambda value=value, uuid=uuid: value.add(uuid))
+            for function in module_index.function_entries.get(uuid, ()):
+                value = function_entries[function]
+                value.discard(uuid)
+                record(lambda value=value, uuid=uuid: value.add(uuid))
+                touched_entries.add(function)
+
+        # Drop functions whose entries were all removed
+        for key in touched_entries:
+            if len(function_entries[key]) != 0:
+                continue
+            record(lambda key=key, entries=function_entries[key],
+                   blocks=function_blocks[key]:
+                   (function_entries.__setitem__(key, entries),
+                    function_blocks.__setitem__(key, blocks)))
             del function_entries[key]
             del function_blocks[key]
 
 
-def remove_functions(ir, factory, function_names=list()):
+def remove_functions(ir, factory, function_names=list(), journal=None,
+                     index=None, function_index=None):
     """Takes a list of function names and deletes them"""
+    if function_index is None:
+        function_index = FunctionIndex(ir)
     delete_blocks = set()
-    functions = get_function_map(ir)
     for f in function_names:
-        delete_blocks.update(
-            get_function_block_addresses(
-                function_name=f,
-                functions=functions,
-                ir=ir
-            )
-        )
-    remove_blocks(ir, factory, delete_blocks)
+        delete_blocks.update(function_index.block_addresses(f))
+    remove_blocks(ir, factory, delete_blocks, journal, index)
@@ -0,0 +1,176 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+#
+# Candidate generation by editing the pretty-printed assembly of the original
+# IR instead of the IR itself
+#
+import logging as log
+import re
+
+TRAMPOLINE = '__gtirb_trampoline'
+
+_FUNCTION_HEADER = '# BEGIN - Function Header'
+_SECTION_DIVIDER = re.compile(r'^#=+$')
+_SECTION_DIRECTIVE = re.compile(
+    r'^\s*\.(section|text|data|bss|pushsection|popsection|previous)\b')
+_FUNCTION_TYPE = re.compile(r'^\s*\.type\s+([^\s,]+)\s*,\s*@function')
+_LABEL = re.compile(r'^\s*([A-Za-z_.$][\w.$@]*):')
+_LABEL_DEFINITION = re.compile(r'^\s*([A-Za-z_.$][\w.$@]*):', re.MULTILINE)
+_GLOBAL = re.compile(r'^\s*\.globl\s+(\S+)', re.MULTILINE)
+_ASSEMBLER_LOCAL = re.compile(r'(?<![\w.$])\.L(?=[\w$])')
+
+
+def global_name(label):
+    """Returns the name a label gets in separately assembled units. Assembler
+    local labels (.L*) never reach the symbol table, so they are renamed."""
+    return _ASSEMBLER_LOCAL.sub('__gtirb_L', label)
+
+
+def globalize(unit):
+    """Renames assembler local labels and declares every label defined in
+    UNIT global and, unless it already was global, hidden"""
+    unit = _ASSEMBLER_LOCAL.sub('__gtirb_L', unit)
+    declared = set(_GLOBAL.findall(unit))
+    defined = set(_LABEL_DEFINITION.findall(unit)) - declared
+    defined.discard(TRAMPOLINE)
+    return unit + ''.join(f".globl {label}\n.hidden {label}\n"
+                          for label in sorted(defined))
+
+
+class AsmLayout():
+    """Text spans of the functions in assembly printed by gtirb-pprinter.
+
+    A function's span starts at its "BEGIN - Function Header" comment and
+    ends at the next function header or section divider. Deleting a
+    function drops its span and equates every label defined in it to the
+    trampoline, which has the same effect on references as pointing the
+    symbolic operands at the trampoline in the IR. Operands taking the
+    difference of two labels (e.g. jump tables) cannot be redirected this
+    way, so candidates deleting their targets fail to assemble."""
+    def __init__(self, asm):
+        self.lines = asm.splitlines(keepends=True)
+        # Function name -> (first line, last line + 1)
+        self.spans = dict()
+        # Function name -> labels defined in the span
+        self.labels = dict()
+        # Spans of the lines before the first section and of the headers of
+        # the leading sections that only set assembler options (such as
+        # .intel_syntax) instead of selecting a section
+        self.preamble = [(0, len(self.lines))]
+        # Sections as (first line, end of header, end of leading text before
+        # the first function, chunks), where chunks are the (name, span) of
+        # its functions and name may be None
+        self.sections = list()
+
+        start = None
+        name = None
+        in_header = False
+
+        def close(end):
+            if start is None:
+                return
+            self.sections[-1][3].append((name, (start, end)))
+            if name is not None:
+                self.spans[name] = (start, end)
+                self.labels[name] = {
+                    m.group(1) for m in map(_LABEL.match,
+                                            self.lines[start:end]) if m}
+
+        for number, line in enumerate(self.lines):
+            stripped = line.strip()
+            if _SECTION_DIVIDER.match(stripped):
+                close(number)
+                start = None
+                name = None
+                if not in_header:
+                    if not self.sections:
+                        self.preamble = [(0, number)]
+                    self.sections.append([number, None, None, list()])
+                else:
+                    self.sections[-1][1] = number + 1
+                in_header = not in_header
+            elif stripped == _FUNCTION_HEADER and self.sections:
+                close(number)
+                if self.sections[-1][2] is None:
+                    self.sections[-1][2] = number
+                start = number
+                name = None
+            elif start is not None and name is None:
+                match = _FUNCTION_TYPE.match(line)
+                if match:
+                    name = match.group(1)
+        close(len(self.lines))
+
+        # Fill in the ends of sections without functions or a closed header
+        ends = [s[0] for s in self.sections[1:]] + [len(self.lines)]
+        for section, end in zip(self.sections, ends):
+            if section[1] is None:
+                section[1] = end
+            if section[2] is None:
+                section[2] = end
+
+        # Options set by leading sections hold for the rest of the file, so
+        # every unit needs them. The text following them stays in the
+        # default section, with an empty header.
+        for section in self.sections:
+            first, header_end = section[0], section[1]
+            if any(map(_SECTION_DIRECTIVE.match,
+                       self.lines[first:header_end])):
+                break
+            self.preamble.append((first, header_end))
+            section[0] = header_end
+        log.info(f"Found {len(self.spans)} functions in the assembly")
+
+    def _text(self, span):
+        return ''.join(self.lines[span[0]:span[1]])
+
+    def units(self, functions=()):
+        """Splits the assembly, with the given functions deleted, into
+        translation units that can be assembled separately: one for the
+        leading text of every section and one for every function. Each unit
+        repeats the preamble and its section header, and every label is made
+        global so that units can refer to each other. Returns the units and
+        the (global) names of the deleted labels, which must be defined as
+        the trampoline when linking."""
+        deleted = set(functions)
+        preamble = ''.join(map(self._text, self.preamble))
+        units = list()
+        for first, header_end, leading_end, chunks in self.sections:
+            header = self._text((first, header_end))
+            units.append(globalize(preamble
+                                   + self._text((first, leading_end))))
+            for name, span in chunks:
+                if name not in deleted or name is None:
+                    units.append(globalize(preamble + header
+                                           + self._text(span)))
+        labels = set()
+        for f in deleted:
+            labels.update(global_name(label)
+                          for label in self.labels.get(f, ()))
+        labels.discard(TRAMPOLINE)
+        return units, labels
+
+    def render(self, functions):
+        """Returns the assembly with the given functions deleted"""
+        deleted = list()
+        for f in functions:
+            if f not in self.spans:
+                log.warning(f"No function {f} found in the assembly")
+                continue
+            deleted.append(self.spans[f])
+        deleted.sort()
+
+        labels = set()
+        for f in functions:
+            labels.update(self.labels.get(f, ()))
+        labels.discard(TRAMPOLINE)
+
+        chunks = list()
+        position = 0
+        for start, end in deleted:
+            chunks.extend(self.lines[position:start])
+            position = end
+        chunks.extend(self.lines[position:])
+        chunks.append('\n')
+        chunks.extend(f".set {label}, {TRAMPOLINE}\n"
+                      for label in sorted(labels))
+        return ''.join(chunks)
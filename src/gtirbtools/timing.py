@@ -0,0 +1,49 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+#
+# Durations of the phases of building a candidate, recorded for the thread
+# building it. Outside of recording() the phases are not recorded.
+#
+from contextlib import contextmanager
+import threading
+import time
+
+_local = threading.local()
+
+
+class PhaseRecord():
+    """Seconds spent in every phase of a unit of work, and notes about it"""
+    def __init__(self):
+        self.phases = dict()
+        self.notes = dict()
+
+
+@contextmanager
+def recording(record):
+    """Records the phases this thread runs in the context into record"""
+    previous = getattr(_local, 'record', None)
+    _local.record = record
+    try:
+        yield record
+    finally:
+        _local.record = previous
+
+
+@contextmanager
+def phase(name):
+    """Times the context as phase name of the current record. The times of
+    a phase that runs more than once add up."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        record = getattr(_local, 'record', None)
+        if record is not None:
+            record.phases[name] = (record.phases.get(name, 0.0)
+                                   + time.monotonic() - start)
+
+
+def note(name, value):
+    """Sets note name of the current record to value"""
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        record.notes[name] = value
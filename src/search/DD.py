@@ -43,8 +43,11 @@
 # Andreas Zeller
 
 from enum import Enum, auto
+import json
 import logging as log
-from functools import lru_cache
+import os
+
+from search.parallel import make_pool, submit_test
 
 
 class Result(Enum):
@@ -56,17 +59,19 @@ class Result(Enum):
 # Helpers
 def listminus(list1, list2):
     """Return a list of all elements of list1 that are not in list2."""
-    return list(set([item for item in list1 if item not in list2]))
+    set2 = set(list2)
+    return list(dict.fromkeys(item for item in list1 if item not in set2))
 
 
 def listintersect(list1, list2):
     """Return the common elements of list1 and list2."""
-    return list(set([item for item in list1 if item in list2]))
+    set2 = set(list2)
+    return list(dict.fromkeys(item for item in list1 if item in set2))
 
 
 def listunion(list1, list2):
     """Return the union of list1 and list2."""
-    return list(set(list1 + list2))
+    return list(dict.fromkeys(list1 + list2))
 
 
 def listsubseteq(list1, list2):
@@ -74,6 +79,45 @@ def listsubseteq(list1, list2):
     return set(list1).issubset(set(list2))
 
 
+# Positions of the bits set in every byte value
+_BIT_POSITIONS = [tuple(i for i in range(8) if byte >> i & 1)
+                  for byte in range(256)]
+
+
+class Universe:
+    """Numbers the items of a search, so that a configuration is an int whose
+    bit i is set if it holds item i. Set algebra on configurations takes
+    O(n/64), and equal configurations are equal, compact, hashable ints."""
+    def __init__(self, items):
+        self.items = list(dict.fromkeys(items))
+        self.index = {item: i for i, item in enumerate(self.items)}
+        self.full = (1 << len(self.items)) - 1
+
+    def config(self, items):
+        """Return the configuration holding ITEMS"""
+        bits = bytearray(len(self.items) // 8 + 1)
+        for item in items:
+            i = self.index[item]
+            bits[i >> 3] |= 1 << (i & 7)
+        return int.from_bytes(bits, 'little')
+
+    def items_of(self, c):
+        """Return the items of configuration C, in their original order"""
+        items = []
+        data = c.to_bytes((c.bit_length() + 7) // 8, 'little')
+        for offset, byte in enumerate(data):
+            if byte:
+                base = offset * 8
+                items.extend(self.items[base + i]
+                             for i in _BIT_POSITIONS[byte])
+        return items
+
+    @staticmethod
+    def size(c):
+        """Return the number of items of configuration C"""
+        return bin(c).count('1')
+
+
 class DD:
     # Delta debugging base class.  To use this class for a particular
     # setting, create a subclass with an overloaded `test()' method.
@@ -93,6 +137,10 @@ class DD:
     # The class includes other previous delta debugging alorithms,
     # which are obsolete now; they are only included for comparison
     # purposes.
+    #
+    # Internally, configurations are bitsets over a Universe of the items
+    # (see above).  Subclasses still see lists of items in `_test()',
+    # `_split()' and `_resolve()'.
 
     # Resolving directions.
     ADD = "ADD"                         # Add deltas to resolve
@@ -105,42 +153,171 @@ class DD:
         self.maximize = True
         self.cachehits = 0
         self.cachemisses = 0
+        self.jobs = 1
+        self.test_count = 0
+        self._pool = None
+        # Items of the current search, set by ddgen() and dddiff(), and the
+        # outcomes of the configurations tested so far over them
+        self.universe = None
+        self._outcomes = dict()
+        # Outcomes computed ahead of time by the pool, and tests still in
+        # flight, both keyed by configuration
+        self._prefetched = dict()
+        self._pending = dict()
+        # Loop state of _dd() and _dddiff() is saved to checkpoint_file at
+        # the start of every run, and restored from it if resume is set
+        self.checkpoint_file = None
+        self.resume = False
 
     # Output
     def coerce(self, c):
         """Return the configuration C as a compact string"""
         # Default: use printable representation
+        if isinstance(c, int):
+            c = self.universe.items_of(c)
         return str(c)
 
     def pretty(self, c):
         """Like coerce(), but sort beforehand"""
+        if isinstance(c, int):
+            c = self.universe.items_of(c)
         sorted_c = c[:]
         sorted_c.sort()
         return self.coerce(sorted_c)
 
     # Testing
-    # maxsize is the maximum number of cached tests
-    @lru_cache(maxsize=16384)
+    def set_universe(self, c):
+        """Number the items C for a new search.  Configurations of earlier
+        searches mean other items, so their outcomes are dropped."""
+        self.universe = Universe(c)
+        self._outcomes.clear()
+        self._prefetched.clear()
+        self._pending.clear()
+
     def test(self, c):
         """Test the configuration C.  Return PASS, FAIL, or UNRESOLVED"""
-        return self._test(c)
+        if c in self._outcomes:
+            self.cachehits += 1
+            return self._outcomes[c]
+        self.cachemisses += 1
+        outcome = None
+        if c in self._prefetched:
+            outcome = self._prefetched.pop(c)
+        elif c in self._pending:
+            future = self._pending.pop(c)
+            if not future.cancelled():
+                outcome = future.result()
+        if outcome is None:
+            self.test_count += 1
+            outcome = self._test(self.universe.items_of(c), self.test_count)
+        self._outcomes[c] = outcome
+        return outcome
 
     def cache_info(self):
-        cinfo = self.test.cache_info()
         log.info("Cache info: "
-                 f"{cinfo.hits}/{cinfo.misses} hits/misses, "
-                 f"{(cinfo.currsize/cinfo.maxsize)*100:.2f}% full")
+                 f"{self.cachehits}/{self.cachemisses} hits/misses, "
+                 f"{len(self._outcomes)} outcomes")
 
-    def _test(self, c):
+    def _test(self, c, test_number):
         """Stub to overload in subclasses"""
         return Result.UNRESOLVED          # Placeholder
 
+    # Parallel testing
+    def start_pool(self):
+        """Start a pool of self.jobs worker processes if jobs > 1"""
+        if self.jobs > 1 and self._pool is None:
+            self._pool = make_pool(self, self.jobs)
+
+    def stop_pool(self):
+        if self._pool is not None:
+            for future in self._pending.values():
+                future.cancel()
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        self._prefetched.clear()
+        self._pending.clear()
+
+    def submit(self, c, test_number):
+        """Schedule the test of C on the pool, return a future of its
+        outcome"""
+        return submit_test(self._pool, c, test_number)
+
+    def prefetch(self, configs):
+        """Test CONFIGS in parallel, in order, until one of them fails.
+
+        Outcomes are stored so that the following calls to test() with the
+        same configurations return immediately. Once the first failing
+        configuration (in the order of CONFIGS) is known, every configuration
+        after it that has not started yet is cancelled, so the search takes
+        the same path as a serial run."""
+        if self._pool is None:
+            return
+
+        futures = list()
+        seen = set()
+        for key in configs:
+            if key in seen:
+                continue
+            seen.add(key)
+            if key in self._prefetched:
+                futures.append((key, None))
+                continue
+            if key not in self._pending:
+                self.test_count += 1
+                self._pending[key] = self.submit(
+                    tuple(self.universe.items_of(key)), self.test_count)
+            futures.append((key, self._pending[key]))
+        log.debug(f"Prefetching {len(futures)} configurations "
+                  f"on {self.jobs} jobs")
+
+        for index, (key, future) in enumerate(futures):
+            if future is None:
+                outcome = self._prefetched[key]
+            else:
+                outcome = future.result()
+                del self._pending[key]
+                self._prefetched[key] = outcome
+            if outcome == Result.FAIL:
+                for later_key, later in futures[index + 1:]:
+                    if later is not None and later.cancel():
+                        del self._pending[later_key]
+                break
+
+    # Checkpointing
+    def save_checkpoint(self, kind, **state):
+        """Save the loop state STATE of algorithm KIND"""
+        if self.checkpoint_file is None:
+            return
+        state.update(kind=kind, test_count=self.test_count)
+        tmp_file = self.checkpoint_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def load_checkpoint(self, kind):
+        """Return the saved loop state of algorithm KIND if resuming, or
+        None if there is nothing to resume from"""
+        if (not self.resume or self.checkpoint_file is None or
+                not os.path.exists(self.checkpoint_file)):
+            return None
+        with open(self.checkpoint_file) as f:
+            state = json.load(f)
+        if state.pop('kind') != kind:
+            log.warning(f"Ignoring checkpoint {self.checkpoint_file} "
+                        f"saved by another algorithm")
+            return None
+        self.test_count = state.pop('test_count')
+        log.info(f"Resuming from run {state['run']} after "
+                 f"{self.test_count} tests")
+        return state
+
     # Splitting
     def split(self, c, n):
         """Split C into [C_1, C_2, ..., C_n]."""
         log.debug(f"Split({self.coerce(c)}, {n})...")
 
-        outcome = self._split(c, n)
+        outcome = [self.universe.config(subset) for subset
+                   in self._split(self.universe.items_of(c), n)]
 
         log.debug(f"Split({self.coerce(c)}, {n}) = {outcome}")
 
@@ -161,12 +338,16 @@ class DD:
         """If direction == ADD, resolve inconsistency by adding deltas
            to CSUB.  Otherwise, resolve by removing deltas from CSUB."""
 
-        log.debug(f"resolve({csub}, {self.coerce(c)}, {direction})...")
+        log.debug(f"resolve({self.coerce(csub)}, {self.coerce(c)}, "
+                  f"{direction})...")
 
-        outcome = self._resolve(csub, c, direction)
+        outcome = self._resolve(self.universe.items_of(csub),
+                                self.universe.items_of(c), direction)
+        if outcome is not None:
+            outcome = self.universe.config(outcome)
 
-        log.debug(f"resolve({csub}, {self.coerce(c)}, "
-                  f"{direction}) = {outcome}")
+        log.debug(f"resolve({self.coerce(csub)}, {self.coerce(c)}, "
+                  f"{direction}) = {self.coerce(outcome)}")
 
         return outcome
 
@@ -179,11 +360,12 @@ class DD:
     def test_and_resolve(self, csub, r, c, direction):
         """Repeat testing CSUB + R while unresolved."""
 
-        initial_csub = csub[:]
-        c2 = listunion(r, c)
+        initial_csub = csub
+        c2 = r | c
+        size = self.universe.size
 
-        csubr = listunion(csub, r)
-        t = self.test(tuple(csubr))
+        csubr = csub | r
+        t = self.test(csubr)
         self.cache_info()
         # necessary to use more resolving mechanisms which can reverse each
         # other, can (but needn't) be used in subclasses
@@ -197,26 +379,26 @@ class DD:
                 # Nothing left to resolve
                 break
 
-            if len(csubr) >= len(c2):
+            if size(csubr) >= size(c2):
                 # Added everything: csub == c2. ("Upper" Baseline)
                 # This has already been tested.
                 csubr = None
                 break
 
-            if len(csubr) <= len(r):
+            if size(csubr) <= size(r):
                 # Removed everything: csub == r. (Baseline)
                 # This has already been tested.
                 csubr = None
                 break
 
-            t = self.test(tuple(csubr))
+            t = self.test(csubr)
 
         self.__resolving = 0
         if csubr is None:
             return Result.UNRESOLVED, initial_csub
 
         # assert t == Result.PASS or t == Result.FAIL
-        csub = listminus(csubr, r)
+        csub = csubr & ~r
         return t, csub
 
     # Inquiries
@@ -226,29 +408,30 @@ class DD:
 
     # Logging
     def report_progress(self, c):
-        if len(c) != self.__last_reported_length:
-            log.info(f"{len(c)} deltas left")
+        size = self.universe.size(c)
+        if size != self.__last_reported_length:
+            log.info(f"{size} deltas left")
             log.debug(f"{self.coerce(c)}")
-            self.__last_reported_length = len(c)
+            self.__last_reported_length = size
 
     def test_mix(self, csub, c, direction):
         if self.minimize:
-            (t, csub) = self.test_and_resolve(csub, [], c, direction)
+            (t, csub) = self.test_and_resolve(csub, 0, c, direction)
             if t == Result.FAIL:
                 return (t, csub)
 
         if self.maximize:
-            csubbar = listminus(self.CC, csub)
-            cbar = listminus(self.CC, c)
+            csubbar = self.CC & ~csub
+            cbar = self.CC & ~c
             if direction == self.ADD:
                 directionbar = self.REMOVE
             else:
                 directionbar = self.ADD
 
-            (tbar, csubbar) = self.test_and_resolve(csubbar, [], cbar,
+            (tbar, csubbar) = self.test_and_resolve(csubbar, 0, cbar,
                                                     directionbar)
 
-            csub = listminus(self.CC, csubbar)
+            csub = self.CC & ~csubbar
 
             if tbar == Result.PASS:
                 t = Result.FAIL
@@ -267,10 +450,15 @@ class DD:
         self.maximize = maximize
 
         n = 2
-        self.CC = c
+        self.set_universe(c)
+        self.CC = self.universe.full
 
         log.debug(f"dd({self.pretty(c)}, {n})...")
-        outcome = self._dd(c, n)
+        self.start_pool()
+        try:
+            outcome = self.universe.items_of(self._dd(self.CC, n))
+        finally:
+            self.stop_pool()
         log.debug(f"dd({self.pretty(c)}, {n}) = {outcome}")
 
         return outcome
@@ -278,19 +466,28 @@ class DD:
     def _dd(self, c, n):
         """Stub to overload in subclasses"""
 
-        assert self.test(tuple([])) == Result.PASS
+        assert self.test(0) == Result.PASS
         self.cache_info()
 
+        size = self.universe.size
         run = 1
         cbar_offset = 0
+        state = self.load_checkpoint('dd')
+        if state is not None:
+            c = self.universe.config(state['c'])
+            n = state['n']
+            cbar_offset = state['cbar_offset']
+            run = state['run']
 
         # We replace the tail recursion from the paper by a loop
         while True:
-            tc = self.test(tuple(c))
+            self.save_checkpoint('dd', c=self.universe.items_of(c), n=n,
+                                 cbar_offset=cbar_offset, run=run)
+            tc = self.test(c)
             self.cache_info()
             assert tc == Result.FAIL or tc == Result.UNRESOLVED
 
-            if n > len(c):
+            if n > size(c):
                 # No further minimizing
                 log.info("done")
                 return c
@@ -299,11 +496,16 @@ class DD:
 
             cs = self.split(c, n)
             log.info(f"Run {run}: Trying "
-                     f"{'+'.join([str(len(cs[i])) for i in range(n)])}")
+                     f"{'+'.join([str(size(cs[i])) for i in range(n)])}")
+            if self.minimize and not self.maximize:
+                # Subsets first, then complements in the order they are
+                # checked below
+                self.prefetch(cs + [c & ~cs[(j + cbar_offset) % n]
+                                    for j in range(n)])
             c_failed = False
             cbar_failed = False
 
-            next_c = c[:]
+            next_c = c
             next_n = n
 
             # Check subsets
@@ -314,7 +516,7 @@ class DD:
 
                 if t == Result.FAIL:
                     # Found
-                    log.debug(f"Found {len(cs[i])} deltas:\n"
+                    log.debug(f"Found {size(cs[i])} deltas:\n"
                               f"{self.pretty(cs[i])}")
                     c_failed = True
                     next_c = cs[i]
@@ -328,19 +530,19 @@ class DD:
                 cbars = n * [Result.UNRESOLVED]
                 for j in range(n):
                     i = (j + cbar_offset) % n
-                    cbars[i] = listminus(c, cs[i])
+                    cbars[i] = c & ~cs[i]
                     t, cbars[i] = self.test_mix(cbars[i], c, self.ADD)
-                    doubled = listintersect(cbars[i], cs[i])
-                    if doubled != []:
-                        cs[i] = listminus(cs[i], doubled)
+                    doubled = cbars[i] & cs[i]
+                    if doubled:
+                        cs[i] &= ~doubled
 
                     if t == Result.FAIL:
-                        log.debug(f"Reduced to {len(cbars[i])}\n"
+                        log.debug(f"Reduced to {size(cbars[i])}\n"
                                   "deltas:\n"
                                   f"{self.pretty(cbars[i])}")
 
                         cbar_failed = True
-                        next_c = listintersect(next_c, cbars[i])
+                        next_c = next_c & cbars[i]
                         next_n = next_n - 1
                         self.report_progress(next_c)
 
@@ -349,12 +551,12 @@ class DD:
                         break
 
             if not c_failed and not cbar_failed:
-                if n >= len(c):
+                if n >= size(c):
                     # No further minimizing
                     log.info("done")
                     return c
 
-                next_n = min(len(c), n * 2)
+                next_n = min(size(c), n * 2)
                 log.info(f"Increase granularity to {next_n}")
                 cbar_offset = (cbar_offset * next_n) // n
 
@@ -374,29 +576,42 @@ class DD:
     # General delta debugging (new TSE version)
     def dddiff(self, c):
         n = 2
+        self.set_universe(c)
         log.debug(f"dddiff({self.pretty(c)}, {n})...")
-        outcome = self._dddiff([], c, n)
+        outcome = tuple(self.universe.items_of(config) for config
+                        in self._dddiff(0, self.universe.full, n))
         log.debug(f"dddiff({self.pretty(c)}, {n}) = {outcome}")
 
         return outcome
 
     def _dddiff(self, c1, c2, n):
+        size = self.universe.size
         run = 1
         cbar_offset = 0
+        state = self.load_checkpoint('dddiff')
+        if state is not None:
+            c1 = self.universe.config(state['c1'])
+            c2 = self.universe.config(state['c2'])
+            n = state['n']
+            cbar_offset = state['cbar_offset']
+            run = state['run']
 
         # We replace the tail recursion from the paper by a loop
         while 1:
+            self.save_checkpoint('dddiff', c1=self.universe.items_of(c1),
+                                 c2=self.universe.items_of(c2), n=n,
+                                 cbar_offset=cbar_offset, run=run)
             log.debug(f"c1 = {self.pretty(c1)}")
             log.debug(f"c2 = {self.pretty(c2)}")
 
             t1 = Result.PASS
             t2 = Result.FAIL
 
-            assert listsubseteq(c1, c2)
-            c = listminus(c2, c1)
+            assert c1 & ~c2 == 0
+            c = c2 & ~c1
             log.debug(f"c2 - c1 = {self.pretty(c)}")
 
-            if n > len(c):
+            if n > size(c):
                 # No further minimizing
                 log.info("done")
                 return (c, c1, c2)
@@ -405,11 +620,11 @@ class DD:
             cs = self.split(c, n)
 
             log.info(f"Run {run}: Trying\n"
-                     f"{'+'.join([str(len(cs[i])) for i in range(n)])}")
+                     f"{'+'.join([str(size(cs[i])) for i in range(n)])}")
             progress = False
 
-            next_c1 = c1[:]
-            next_c2 = c2[:]
+            next_c1 = c1
+            next_c2 = c2
             next_n = n
 
             # Check subsets
@@ -418,7 +633,7 @@ class DD:
                 log.debug(f"Trying {self.pretty(cs[i])}")
 
                 (t, csub) = self.test_and_resolve(cs[i], c1, c, self.REMOVE)
-                csub = listunion(c1, csub)
+                csub = c1 | csub
 
                 if t == Result.FAIL and t1 == Result.PASS:
                     # Found
@@ -426,7 +641,7 @@ class DD:
                     next_c2 = csub
                     next_n = 2
                     cbar_offset = 0
-                    log.debug(f"Reduce c2 to {len(next_c2)} deltas:\n"
+                    log.debug(f"Reduce c2 to {size(next_c2)} deltas:\n"
                               f"{self.pretty(next_c2)}")
                     break
 
@@ -436,13 +651,13 @@ class DD:
                     next_c1 = csub
                     next_n = max(next_n - 1, 2)
                     cbar_offset = i
-                    log.debug(f"Increase c1 to {len(next_c1)} deltas:\n"
+                    log.debug(f"Increase c1 to {size(next_c1)} deltas:\n"
                               f"{self.pretty(next_c1)}")
                     break
 
-                csub = listminus(c, cs[i])
+                csub = c & ~cs[i]
                 (t, csub) = self.test_and_resolve(csub, c1, c, self.ADD)
-                csub = listunion(c1, csub)
+                csub = c1 | csub
 
                 if t == Result.PASS and t2 == Result.FAIL:
                     # Found
@@ -450,7 +665,7 @@ class DD:
                     next_c1 = csub
                     next_n = 2
                     cbar_offset = 0
-                    log.debug(f"Increase c1 to {len(next_c1)} deltas:\n"
+                    log.debug(f"Increase c1 to {size(next_c1)} deltas:\n"
                               f"{self.pretty(next_c1)}")
                     break
 
@@ -460,19 +675,19 @@ class DD:
                     next_c2 = csub
                     next_n = max(next_n - 1, 2)
                     cbar_offset = i
-                    log.debug(f"Reduce c2 to {len(next_c2)} deltas:\n"
+                    log.debug(f"Reduce c2 to {size(next_c2)} deltas:\n"
                               f"{self.pretty(next_c2)}")
                     break
 
             if progress:
-                self.report_progress(listminus(next_c2, next_c1))
+                self.report_progress(next_c2 & ~next_c1)
             else:
-                if n >= len(c):
+                if n >= size(c):
                     # No further minimizing
                     log.info("Done")
                     return (c, c1, c2)
 
-                next_n = min(len(c), n * 2)
+                next_n = min(size(c), n * 2)
                 log.info(f"Increase granularity to {next_n}")
                 cbar_offset = (cbar_offset * next_n) // n
 
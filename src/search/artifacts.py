@@ -0,0 +1,124 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+import gzip
+import hashlib
+import json
+import logging as log
+import os
+import shutil
+import threading
+
+
+class ArtifactStore():
+    """Content-addressed store for the files of saved test directories.
+
+    Every file is stored once under the digest of its contents in
+    workdir/artifacts and saved directories (workdir/{pass,fail}/N) hold
+    hard links to the stored files, so saving a test directory only copies
+    files that have other links (e.g. in the binary cache) and identical
+    files (e.g. the same executable built from different deletions) take
+    space once. With compress, files are stored gzipped and linked with a
+    .gz suffix. With keep_passing, only that many passing directories are
+    kept, preferring the smallest executables."""
+
+    METADATA = 'artifact.json'
+
+    def __init__(self, workdir, compress=False, keep_passing=None):
+        self.workdir = workdir
+        self.compress = compress
+        self.keep_passing = keep_passing
+        self.object_dir = os.path.join(workdir, 'artifacts')
+        os.makedirs(self.object_dir, exist_ok=True)
+
+    @staticmethod
+    def _digest(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _store(self, path):
+        """Adds the file at path to the store, returns the stored file name"""
+        name = self._digest(path) + ('.gz' if self.compress else '')
+        stored = os.path.join(self.object_dir, name)
+        if os.path.exists(stored):
+            return name
+        # Parallel searches may store the same file, so build it under a
+        # name unique to this thread and move it into place
+        tmp_name = f"{stored}.{os.getpid()}.{threading.get_ident()}"
+        if self.compress:
+            with open(path, 'rb') as src, gzip.open(tmp_name, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+        elif os.stat(path).st_nlink > 1:
+            # Linking a file that has other names, such as an executable
+            # from the binary cache, would leave the stored file more links
+            # than remove() accounts for
+            shutil.copyfile(path, tmp_name)
+        else:
+            try:
+                os.link(path, tmp_name)
+            except OSError:
+                shutil.copyfile(path, tmp_name)
+        os.replace(tmp_name, stored)
+        return name
+
+    def save(self, src_dir, result, name, size=None):
+        """Saves the files in src_dir as workdir/result/name. size is the
+        size of the executable, used to rank passing directories."""
+        dst_dir = os.path.join(self.workdir, result, name)
+        objects = dict()
+        try:
+            os.makedirs(dst_dir)
+            for root, _, files in os.walk(src_dir):
+                rel_root = os.path.relpath(root, src_dir)
+                os.makedirs(os.path.join(dst_dir, rel_root), exist_ok=True)
+                for f in files:
+                    rel_path = os.path.normpath(os.path.join(rel_root, f))
+                    stored = self._store(os.path.join(root, f))
+                    if self.compress:
+                        rel_path += '.gz'
+                    os.link(os.path.join(self.object_dir, stored),
+                            os.path.join(dst_dir, rel_path))
+                    objects[rel_path] = stored
+            with open(os.path.join(dst_dir, self.METADATA), 'w') as f:
+                json.dump({'size': size, 'objects': objects}, f)
+        except OSError as e:
+            log.error(f"Error saving {src_dir} to {dst_dir}:\n{e}")
+            return
+        if result == 'pass' and self.keep_passing is not None:
+            self.prune(result)
+
+    def remove(self, saved_dir):
+        """Removes a saved directory, and the stored files only it used"""
+        try:
+            with open(os.path.join(saved_dir, self.METADATA)) as f:
+                objects = json.load(f)['objects'].values()
+        except (OSError, ValueError):
+            objects = ()
+        shutil.rmtree(saved_dir, ignore_errors=True)
+        for name in objects:
+            stored = os.path.join(self.object_dir, name)
+            try:
+                if os.stat(stored).st_nlink == 1:
+                    os.remove(stored)
+            except OSError:
+                pass
+
+    def prune(self, result):
+        """Keeps the keep_passing saved directories of result with the
+        smallest executables"""
+        result_dir = os.path.join(self.workdir, result)
+        saved = list()
+        with os.scandir(result_dir) as entries:
+            for entry in entries:
+                try:
+                    with open(os.path.join(entry.path, self.METADATA)) as f:
+                        size = json.load(f)['size']
+                except (OSError, ValueError):
+                    continue
+                if size is not None:
+                    saved.append((size, entry.name, entry.path))
+        saved.sort()
+        for _, _, path in saved[self.keep_passing:]:
+            log.debug(f"Removing {path}")
+            self.remove(path)
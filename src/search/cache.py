@@ -0,0 +1,105 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+import hashlib
+import logging as log
+import os
+import sqlite3
+import threading
+
+
+class ResultCache():
+    """Persistent record of test outcomes, shared across runs and search
+    strategies. Outcomes are keyed by the set of deleted items within a
+    context that identifies the input IR, build setup and test suite, so a
+    cache file can safely be reused by any later run. Outcomes are also
+    keyed by the digest of the executable, as different deletions often
+    build identical executables."""
+
+    def __init__(self, path, deleter, tester):
+        self.path = path
+        self.deleter = deleter
+        self.tester = tester
+        self._context = None
+        self._context_pruned = None
+        self.hits = 0
+        self.misses = 0
+        self.binary_hits = 0
+        self.binary_misses = 0
+        # SQLite connections cannot be shared with forked workers or other
+        # threads, so every thread of every process opens its own
+        self._local = threading.local()
+
+    @property
+    def context(self):
+        """Digest of the deleter and tester. It is computed again whenever
+        the deleter prunes items, since the same deleted items then stand
+        for a different program."""
+        pruned = len(self.deleter.pruned)
+        if pruned != self._context_pruned:
+            self._context = hashlib.sha256(
+                (self.deleter.digest() + '\n'
+                 + self.tester.identity()).encode('utf-8')).hexdigest()
+            self._context_pruned = pruned
+        return self._context
+
+    def _connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=60)
+            local.conn.execute("CREATE TABLE IF NOT EXISTS results "
+                               "(context TEXT, items TEXT, result TEXT, "
+                               "PRIMARY KEY (context, items))")
+            local.conn.execute("CREATE TABLE IF NOT EXISTS binaries "
+                               "(context TEXT, digest TEXT, result TEXT, "
+                               "PRIMARY KEY (context, digest))")
+            local.conn.commit()
+            local.pid = os.getpid()
+        return local.conn
+
+    @staticmethod
+    def key(items):
+        """Canonical digest of a set of items"""
+        canonical = '\n'.join(sorted({str(i) for i in items}))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def get(self, items):
+        """Returns the cached outcome of deleting ITEMS, or None"""
+        row = self._connection().execute(
+            "SELECT result FROM results WHERE context = ? AND items = ?",
+            (self.context, self.key(items))).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, items, result):
+        """Records RESULT as the outcome of deleting ITEMS"""
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                     (self.context, self.key(items), result))
+        conn.commit()
+
+    def get_binary(self, digest):
+        """Returns the cached outcome of testing the executable with the
+        given digest, or None"""
+        row = self._connection().execute(
+            "SELECT result FROM binaries WHERE context = ? AND digest = ?",
+            (self.context, digest)).fetchone()
+        if row is None:
+            self.binary_misses += 1
+            return None
+        self.binary_hits += 1
+        return row[0]
+
+    def put_binary(self, digest, result):
+        """Records RESULT as the outcome of testing the executable with the
+        given digest"""
+        conn = self._connection()
+        conn.execute("INSERT OR REPLACE INTO binaries VALUES (?, ?, ?)",
+                     (self.context, digest, result))
+        conn.commit()
+
+    def log_info(self):
+        log.info(f"Result cache: {self.hits}/{self.misses} hits/misses, "
+                 f"{self.binary_hits}/{self.binary_misses} hits/misses "
+                 "by executable")
@@ -1,14 +1,16 @@
 # Copyright (C) 2020 GrammaTech, Inc.
+from collections import deque
+from concurrent.futures import Future
 from enum import Enum
 import logging as log
 import os
-import shutil
 
 from gtirb import *
 
 import search.DD as DD
 
-from gtirbtools.deleter import BlockDeleter, FunctionDeleter, IRGenerationError
+from search.evaluate import Evaluator, run_search
+from search.pipeline import Pipeline
 
 
 class Result(Enum):
@@ -21,71 +23,171 @@ class Result(Enum):
 class Delta(DD.DD):
     """Base class for delta debugging approaches."""
 
-    def __init__(self, save_files, tester, deleter):
+    def __init__(self, save_files, tester, deleter, jobs=1, cache=None,
+                 resume=False, artifacts=None, pipeline=None, trace=None):
         super().__init__()
         self.save_files = save_files
         self.tester = tester
         self.deleter = deleter
-        self.test_count = 0
-
-    def _test(self, items):
-        def finish_test(test_dir, test_result):
-            """Saves the test directory depending on the result"""
-            def copy_dir(dst):
-                try:
-                    shutil.copytree(src=test_dir, dst=dst)
-                except OSError as e:
-                    log.error(f"Error copying {test_dir} to {dst}:\n{e}")
-            result = {Result.PASS: 'pass',
-                      Result.FAIL: 'fail'}[test_result]
-            save_dir = os.path.join(self.deleter.workdir,
-                                    result,
-                                    str(self.test_count))
-            if self.save_files == 'all':
-                copy_dir(save_dir)
-            elif self.save_files == 'passing' and result == 'fail':
-                copy_dir(save_dir)
-            log.info(result.upper())
-            return test_result
-
-        items = set(self.deleter.items)
-        delete_items = [x for x in self.deleter.items if x not in items]
-        delete_items_list = ' '.join(sorted([str(b) for b in delete_items]))
-        self.test_count += 1
-        log.info(f"Test #{self.test_count}")
-        log.debug(f"Processing: \n{delete_items_list}")
-
-        try:
-            test_dir = self.deleter.delete(delete_items,
-                                           str(self.test_count) + '-')
-        except IRGenerationError as e:
-            return finish_test(e.dir_name, Result.FAIL)
-
-        exe = os.path.join(test_dir.name, self.deleter.binary_name)
-        self.tester.binary = exe
-
-        # Run tests
-        log.info("Testing")
-        passed, failed = self.tester.run_tests()
-        if failed != 0:
-            return finish_test(test_dir.name, Result.FAIL)
+        self.jobs = jobs
+        self.cache = cache
+        # Number of workers per stage when evaluating in a Pipeline
+        self.pipeline = pipeline
+        self.evaluator = Evaluator(deleter, tester, save_files, cache,
+                                   artifacts, trace)
+        self.artifacts = self.evaluator.artifacts
+        self.checkpoint_file = os.path.join(deleter.workdir,
+                                            'checkpoint.json')
+        self.resume = resume
+        # Item -> position in an order keeping dependent items together, and
+        # item -> connected component of the item graph, see _locality()
+        self._rank = None
+        self._component = None
+        # Item -> items it can only be reached through, and the reverse,
+        # see _dependencies()
+        self._predecessors = None
+        self._successors = None
+
+    def delete_items(self, items):
+        """The configuration holds the items to keep, returns the items to
+        delete"""
+        items = set(items)
+        return [x for x in self.deleter.items if x not in items]
+
+    @staticmethod
+    def dd_result(outcome):
+        """Returns the DD result of a test outcome ('pass' or 'fail')"""
+        return {'pass': Result.PASS, 'fail': Result.FAIL}[outcome].value
+
+    def _test(self, items, test_number, final=False):
+        if isinstance(self._pool, Pipeline):
+            # Prefetched candidates may still be generating in the pipeline,
+            # which must be the only thread modifying the deleter's IR
+            return self.submit(items, test_number).result()
+        if not final and self.unreachable(items):
+            log.info(f"Test #{test_number}: UNRESOLVED, keeps unreachable "
+                     "items")
+            return DD.Result.UNRESOLVED
+        return self.dd_result(self.evaluator.evaluate(
+            self.delete_items(items), test_number, final))
+
+    def _locality(self):
+        """Orders the items breadth-first along the deleter's item graph and
+        numbers its connected components, once per search"""
+        if self._rank is None:
+            graph = self.deleter.item_graph()
+            position = {x: i for i, x in enumerate(self.deleter.items)}
+            self._rank = dict()
+            self._component = dict()
+            for start in self.deleter.items:
+                if start in self._rank:
+                    continue
+                component = start
+                self._rank[start] = len(self._rank)
+                queue = deque([start])
+                while queue:
+                    x = queue.popleft()
+                    self._component[x] = component
+                    neighbours = [n for n in graph.get(x, ())
+                                  if n in position and n not in self._rank]
+                    for n in sorted(neighbours, key=position.get):
+                        self._rank[n] = len(self._rank)
+                        queue.append(n)
+        return self._rank, self._component
+
+    def _split(self, c, n):
+        """Splits C into N subsets of dependent items. The items are ordered
+        by _locality() and cut into slices of about equal size, moving each
+        cut to a boundary between connected components when there is one
+        within a quarter of the slice size."""
+        rank, component = self._locality()
+        c = sorted(c, key=lambda x: rank.get(x, len(rank)))
+        subsets = []
+        start = 0
+        for i in range(n):
+            size = (len(c) - start) // (n - i)
+            end = start + size
+            # Every remaining subset needs at least one item
+            last_cut = len(c) - (n - i - 1)
+            if i < n - 1:
+                for d in range(size // 4 + 1):
+                    cuts = [cut for cut in (end - d, end + d)
+                            if start < cut < last_cut and
+                            component.get(c[cut - 1]) != component.get(c[cut])]
+                    if cuts:
+                        end = cuts[0]
+                        break
+            subsets.append(c[start:end])
+            start = end
+        return subsets
+
+    def _dependencies(self):
+        """The deleter's item predecessors and their successors, once per
+        search. Items that are unreachable even when every item is kept are
+        left out, so the whole configuration is always consistent."""
+        if self._predecessors is None:
+            self._predecessors = self.deleter.item_predecessors()
+            self._successors = dict()
+            for x, sources in self._predecessors.items():
+                for source in sources:
+                    self._successors.setdefault(source, set()).add(x)
+            for x in self.unreachable(self.deleter.items):
+                del self._predecessors[x]
+        return self._predecessors, self._successors
+
+    def unreachable(self, c):
+        """Returns the items of C that can only be reached through items
+        that C does not keep"""
+        predecessors, successors = self._dependencies()
+        kept = set(c)
+        reached = {x for x in kept if x not in predecessors}
+        queue = list(reached)
+        while queue:
+            for x in successors.get(queue.pop(), ()):
+                if x in kept and x not in reached:
+                    reached.add(x)
+                    queue.append(x)
+        return kept - reached
+
+    def _resolve(self, csub, c, direction):
+        """Makes CSUB consistent before it is built. With direction ADD, the
+        predecessors in C of unreachable items are added back, transitively.
+        Whatever is still unreachable is then removed."""
+        unreachable = self.unreachable(csub)
+        if not unreachable:
+            return None
+        predecessors, _ = self._dependencies()
+        kept = set(csub)
+        if direction == self.ADD:
+            allowed = set(c)
+            queue = list(unreachable)
+            while queue:
+                for x in predecessors.get(queue.pop(), set()) & allowed:
+                    if x not in kept:
+                        kept.add(x)
+                        queue.append(x)
+        kept -= self.unreachable(kept)
+        resolved = [x for x in csub if x in kept]
+        resolved_set = set(resolved)
+        return resolved + [x for x in c
+                           if x in kept and x not in resolved_set]
+
+    def start_pool(self):
+        if self.pipeline is not None and self._pool is None:
+            self._pool = Pipeline(self.evaluator, self.pipeline)
         else:
-            log.debug("Deleted:\n"
-                      f"{delete_items_list}")
-            new_size = os.stat(exe).st_size
-            finish_test(test_dir.name, Result.PASS)
-            log.info(f"New file size: {new_size} bytes, "
-                     f"{new_size / self.deleter.original_size * 100:.2f}% "
-                     "of original size")
-            return Result.PASS
+            super().start_pool()
+
+    def submit(self, c, test_number):
+        if isinstance(self._pool, Pipeline):
+            if self.unreachable(c):
+                future = Future()
+                future.set_result(DD.Result.UNRESOLVED)
+                return future
+            return self._pool.submit(self.delete_items(c), test_number,
+                                     self.dd_result)
+        return super().submit(c, test_number)
 
     def run(self):
-        self.start_time = datetime.now()
-        results = self.ddmin(self.deleter.items)
-        self.finish_time = datetime.now()
-        log.info(f"Items to delete:\n{' '.join(results)}")
-        runtime = self.finish_time - self.start_time
-        log.info(f"Runtime: {runtime}")
-        log.info("Building and testing final configuration")
-        self._test(results)
-        return results
+        return run_search(self, lambda: self.ddmin(self.deleter.items),
+                          "Items to keep")
@@ -0,0 +1,200 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+from datetime import datetime
+import logging as log
+import os
+import time
+
+from gtirbtools.build import file_digest
+from gtirbtools.deleter import IRGenerationError
+from gtirbtools.timing import PhaseRecord, phase, recording
+from search.artifacts import ArtifactStore
+
+
+class Candidate():
+    """State of a candidate (a set of items to delete) being evaluated"""
+    def __init__(self, items, test_number, final=False):
+        self.items = items
+        self.test_number = test_number
+        self.final = final
+        self.test_dir = None
+        self.exe_digest = None
+        self.size = None
+        # 'pass' or 'fail' once known
+        self.result = None
+        self.cached = False
+        self.identical = False
+        # Timings for the trace
+        self.start_time = time.monotonic()
+        self.stages = dict()
+        self.record = PhaseRecord()
+        self.tests_run = None
+        self.test_cpu = None
+
+
+def run_search(searcher, search, heading, item_str=str, final=True):
+    """Runs search() for searcher, logging the resulting items under heading
+    and the statistics of the run, and returns its results. With final,
+    the resulting configuration is then built and tested with
+    searcher._test(results, test_number, final=True)."""
+    # Build the original once here so that parallel workers inherit it
+    searcher.deleter.original_size
+    searcher.start_time = datetime.now()
+    results = search()
+    searcher.finish_time = datetime.now()
+    log.info(f"{heading}:\n{' '.join(item_str(x) for x in results)}")
+    log.info(f"Runtime: {searcher.finish_time - searcher.start_time}")
+    if searcher.cache is not None:
+        searcher.cache.log_info()
+    if searcher.deleter.binary_cache is not None:
+        searcher.deleter.binary_cache.log_info()
+    if final:
+        log.info("Building and testing final configuration")
+        searcher.test_count += 1
+        searcher._test(results, searcher.test_count, final=True)
+    return results
+
+
+class Evaluator():
+    """Builds and tests candidates for the search strategies, reusing cached
+    outcomes and saving test directories as configured.
+
+    Evaluation is split into stages (see STAGES), each taking a Candidate and
+    either advancing it or setting its result, so that a Pipeline can run
+    the stages of different candidates concurrently."""
+
+    STAGES = ('generate', 'print_assembly', 'compile', 'test')
+
+    def __init__(self, deleter, tester, save_files, cache=None,
+                 artifacts=None, trace=None):
+        self.deleter = deleter
+        self.tester = tester
+        self.save_files = save_files
+        self.cache = cache
+        if artifacts is None:
+            artifacts = ArtifactStore(deleter.workdir)
+        self.artifacts = artifacts
+        # A search.trace.Trace receiving a record per candidate
+        self.trace = trace
+
+    def evaluate(self, items, test_number, final=False):
+        """Builds and tests the program with items deleted. Returns 'pass'
+        if the tests pass and 'fail' otherwise."""
+        candidate = self.start(items, test_number, final)
+        for stage in self.STAGES:
+            if candidate.result is not None:
+                break
+            self.run_stage(stage, candidate)
+        return self.finish(candidate)
+
+    def run_stage(self, stage, candidate):
+        """Runs stage on candidate, recording how long it and its phases
+        take"""
+        start = time.monotonic()
+        with recording(candidate.record):
+            getattr(self, stage)(candidate)
+        candidate.stages[stage] = time.monotonic() - start
+
+    def start(self, items, test_number, final=False):
+        candidate = Candidate(items, test_number, final)
+        items_list = ' '.join(sorted([str(b) for b in items]))
+        log.info(f"Test #{test_number}")
+        log.debug(f"Processing: \n{items_list}")
+
+        if not final and self.cache is not None:
+            cached = self.cache.get(items)
+            if cached is not None:
+                log.info(f"Cached {cached.upper()}")
+                candidate.result = cached
+                candidate.cached = True
+        return candidate
+
+    def generate(self, candidate):
+        try:
+            candidate.test_dir = self.deleter.generate(
+                candidate.items, str(candidate.test_number) + '-',
+                verify=candidate.final)
+        except IRGenerationError as e:
+            candidate.test_dir = e.test_dir
+            candidate.result = 'fail'
+
+    def print_assembly(self, candidate):
+        try:
+            self.deleter.print_assembly(candidate.test_dir, candidate.items,
+                                        verify=candidate.final)
+        except IRGenerationError:
+            candidate.result = 'fail'
+
+    def compile(self, candidate):
+        try:
+            self.deleter.compile(candidate.test_dir, candidate.items,
+                                 verify=candidate.final)
+        except IRGenerationError:
+            candidate.result = 'fail'
+
+    def test(self, candidate):
+        exe = os.path.join(candidate.test_dir.name, self.deleter.binary_name)
+        candidate.size = os.stat(exe).st_size
+
+        # Different deletions often build identical executables
+        if self.cache is not None:
+            with phase('digest'):
+                candidate.exe_digest = file_digest(exe)
+            if not candidate.final:
+                cached = self.cache.get_binary(candidate.exe_digest)
+                if cached is not None:
+                    log.info("Identical executable tested before")
+                    candidate.result = cached
+                    candidate.identical = True
+                    return
+
+        # Run tests
+        log.info("Testing")
+        tester = self.tester.for_binary(exe)
+        with phase('tests'):
+            passed, failed = tester.run_tests()
+        candidate.tests_run = passed + failed
+        candidate.test_cpu = tester.cpu_seconds
+        candidate.result = 'fail' if failed != 0 else 'pass'
+
+    def finish(self, candidate):
+        """Saves and removes the test directory and records the outcome"""
+        result = candidate.result
+        if candidate.test_dir is not None:
+            if (self.save_files == 'all' or
+                    (self.save_files == 'passing' and result == 'pass')):
+                self.artifacts.save(candidate.test_dir.name, result,
+                                    str(candidate.test_number),
+                                    candidate.size)
+            candidate.test_dir.cleanup()
+        if self.cache is not None and not candidate.cached:
+            self.cache.put(candidate.items, result)
+            if candidate.exe_digest is not None:
+                self.cache.put_binary(candidate.exe_digest, result)
+        log.info(f"Test #{candidate.test_number}: {result.upper()}")
+        if result == 'pass' and candidate.size is not None:
+            log.debug("Deleted:\n"
+                      f"{' '.join(sorted([str(b) for b in candidate.items]))}")
+            log.info(f"New file size: {candidate.size} bytes, "
+                     f"{candidate.size / self.deleter.original_size * 100:.2f}"
+                     "% of original size")
+        if self.trace is not None:
+            self.trace.write(self.trace_record(candidate))
+        return result
+
+    def trace_record(self, candidate):
+        """Returns the trace record of a finished candidate, see
+        search.trace"""
+        return {'test': candidate.test_number,
+                'time': time.time(),
+                'items': len(candidate.items),
+                'final': candidate.final,
+                'outcome': candidate.result,
+                'cached': candidate.cached,
+                'identical': candidate.identical,
+                'size': candidate.size,
+                'tests_run': candidate.tests_run,
+                'test_cpu': candidate.test_cpu,
+                'total': time.monotonic() - candidate.start_time,
+                'stages': candidate.stages,
+                'phases': candidate.record.phases,
+                'notes': candidate.record.notes}
@@ -0,0 +1,120 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+from datetime import datetime
+import logging as log
+import os
+
+from gtirbtools.deleter import GroupDeleter
+from search.delta import Delta
+
+
+def deleted_items(search, results):
+    """Returns the items deleted by the results of search, which are the
+    items to keep for delta debugging and the items to delete otherwise"""
+    if isinstance(search, Delta):
+        return search.delete_items(results)
+    return list(results)
+
+
+class Hierarchical():
+    """Reduces functions first, then the basic blocks of the functions that
+    survive, on top of the IR with the unneeded functions deleted.
+
+    function_search is a search over a FunctionDeleter. make_block_search
+    is called with the name of the reduced IR file, the names of the
+    surviving functions and a working directory, and returns a search over
+    a BlockDeleter for them."""
+
+    def __init__(self, function_search, make_block_search):
+        self.function_search = function_search
+        self.make_block_search = make_block_search
+        self.block_search = None
+
+    def run(self):
+        """Returns the deleted functions and the results of the block
+        search"""
+        self.start_time = datetime.now()
+        log.info("Reducing functions")
+        deleter = self.function_search.deleter
+        searched = deleted_items(self.function_search,
+                                 self.function_search.run())
+        functions = deleter.pruned + list(searched)
+        surviving = deleter.surviving(functions)
+        log.info(f"{len(surviving)} of {len(deleter.functions)} functions "
+                 "remain")
+
+        # Functions pruned before the search are already gone from the IR
+        block_dir = os.path.join(deleter.workdir, 'blocks')
+        os.makedirs(block_dir, exist_ok=True)
+        ir_file = deleter.save_ir(searched, block_dir)
+        log.info("Reducing blocks of the remaining functions")
+        self.block_search = self.make_block_search(ir_file, surviving,
+                                                   block_dir)
+        blocks = self.block_search.run()
+        self.finish_time = datetime.now()
+        log.info(f"Total runtime: {self.finish_time - self.start_time}")
+        return functions, blocks
+
+
+class HDD():
+    """Hierarchical delta debugging (Misherghi and Su, ICSE 2006) over the
+    modules, functions and blocks of the IR of a BlockDeleter.
+
+    Each level searches over the nodes of the level whose parents survived
+    the previous level, deleting whole nodes at a time: first modules, then
+    functions, then blocks. Levels with a single node are skipped.
+    make_search is called with a GroupDeleter for every level, which works
+    in its own directory under the deleter's working directory, and returns
+    a search over it."""
+
+    OUTSIDE_FUNCTIONS = '<outside functions>'
+
+    def __init__(self, deleter, make_search):
+        self.deleter = deleter
+        self.make_search = make_search
+        self.searches = list()
+
+    def search_level(self, level, groups, deleted):
+        """Searches the groups of level on top of the deleted items.
+        Returns the items deleted, including those given, and the groups
+        that survive."""
+        if len(groups) < 2:
+            return deleted, list(groups)
+        log.info(f"Reducing {len(groups)} {level}")
+        level_deleter = GroupDeleter(self.deleter, groups, deleted)
+        level_deleter.workdir = os.path.join(self.deleter.workdir,
+                                             f"hdd-{level}")
+        os.makedirs(level_deleter.workdir, exist_ok=True)
+        search = self.make_search(level_deleter)
+        self.searches.append(search)
+        removed = deleted_items(search, search.run())
+        removed_set = set(removed)
+        survivors = [g for g in groups if g not in removed_set]
+        log.info(f"{len(survivors)} of {len(groups)} {level} remain")
+        return level_deleter.expand(removed), survivors
+
+    def run(self):
+        """Returns the deleted blocks"""
+        self.start_time = datetime.now()
+        hierarchy = self.deleter.function_hierarchy()
+        deleted = list()
+
+        modules = {i: [b for blocks in functions.values() for b in blocks]
+                   for i, functions in enumerate(hierarchy)}
+        deleted, survivors = self.search_level('modules', modules, deleted)
+
+        functions = dict()
+        for i in survivors:
+            for name, blocks in hierarchy[i].items():
+                if name is None:
+                    name = self.OUTSIDE_FUNCTIONS
+                if len(hierarchy) > 1:
+                    name = f"{i}:{name}"
+                functions[name] = blocks
+        deleted, survivors = self.search_level('functions', functions,
+                                               deleted)
+
+        blocks = {b: [b] for name in survivors for b in functions[name]}
+        deleted, _ = self.search_level('blocks', blocks, deleted)
+        self.finish_time = datetime.now()
+        log.info(f"Total runtime: {self.finish_time - self.start_time}")
+        return deleted
@@ -0,0 +1,30 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import sys
+
+# Worker side of the parallel test pools. Workers are forked from the search
+# process, so they inherit the search object (and its deleter and tester)
+# instead of having it pickled.
+_searcher = None
+
+
+def _worker_test(items, test_number):
+    return _searcher._test(items, test_number)
+
+
+def make_pool(searcher, jobs):
+    """Returns a pool of JOBS processes that run searcher._test()"""
+    # Workers are forked when tests are submitted, after _searcher is set.
+    # Python 3.6 has no initializer, nor mp_context, and always forks.
+    global _searcher
+    _searcher = searcher
+    if sys.version_info < (3, 7):
+        return ProcessPoolExecutor(max_workers=jobs)
+    return ProcessPoolExecutor(max_workers=jobs,
+                               mp_context=multiprocessing.get_context('fork'))
+
+
+def submit_test(pool, items, test_number):
+    """Schedules searcher._test(ITEMS, TEST_NUMBER) on POOL"""
+    return pool.submit(_worker_test, items, test_number)
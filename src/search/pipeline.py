@@ -0,0 +1,82 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+from concurrent.futures import Future
+import logging as log
+import queue
+import threading
+
+
+class Pipeline():
+    """Evaluates candidates submitted asynchronously in the stages of an
+    Evaluator. Every stage has its own worker threads and bounded input
+    queue, so building some candidates overlaps with testing others. The
+    generate stage modifies the IR in place and always has one worker."""
+
+    def __init__(self, evaluator, workers=1, queue_size=None):
+        self.evaluator = evaluator
+        if queue_size is None:
+            queue_size = 2 * workers
+        stages = evaluator.STAGES
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self._threads = list()
+        for index, stage in enumerate(stages):
+            count = 1 if stage == 'generate' else workers
+            self._threads.append([
+                threading.Thread(target=self._work, args=(index,),
+                                 name=f"{stage}-{n}", daemon=True)
+                for n in range(count)])
+            for thread in self._threads[-1]:
+                thread.start()
+        log.info(f"Started pipeline with {workers} workers per stage")
+
+    def submit(self, items, test_number, transform=None):
+        """Schedules the evaluation of a candidate, returns a future of its
+        outcome ('pass' or 'fail'), passed through transform if given.
+        Candidates can be cancelled until they start. Blocks while the first
+        queue is full."""
+        future = Future()
+        candidate = self.evaluator.start(items, test_number)
+        job = (candidate, future, transform)
+        if candidate.result is not None:
+            future.set_running_or_notify_cancel()
+            self._finish(job)
+        else:
+            self._queues[0].put(job)
+        return future
+
+    def _finish(self, job):
+        candidate, future, transform = job
+        outcome = self.evaluator.finish(candidate)
+        future.set_result(outcome if transform is None else transform(outcome))
+
+    def _work(self, index):
+        stage = self.evaluator.STAGES[index]
+        last = index == len(self._queues) - 1
+        while True:
+            job = self._queues[index].get()
+            if job is None:
+                return
+            candidate, future, _ = job
+            if index == 0 and not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self.evaluator.run_stage(stage, candidate)
+                if candidate.result is not None or last:
+                    self._finish(job)
+                else:
+                    self._queues[index + 1].put(job)
+            except Exception as e:
+                log.error(f"Test #{candidate.test_number} failed in "
+                          f"{stage}: {e}")
+                if candidate.test_dir is not None:
+                    candidate.test_dir.cleanup()
+                future.set_exception(e)
+
+    def shutdown(self, wait=True):
+        """Stops the workers once the queued candidates are evaluated. The
+        queues are always drained, wait is accepted for compatibility with
+        executors."""
+        for stage_queue, threads in zip(self._queues, self._threads):
+            for _ in threads:
+                stage_queue.put(None)
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,76 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+import logging as log
+
+from search.simple import Result, Simple
+
+
+class ProbDD(Simple):
+    """Probabilistic delta debugging (Wang et al., "Probabilistic Delta
+    Debugging", ESEC/FSE 2021).
+
+    Every item has a probability of being required, initially p0. Each step
+    tries to delete, on top of what is already deleted, the items with the
+    lowest probabilities that maximize the expected number of items
+    deleted. If the tests pass, the items are deleted for good. Otherwise
+    their probabilities are raised by Bayes' rule, given that at least one
+    of them is required, and a single item that cannot be deleted is
+    required. The search ends when every item is deleted or required."""
+
+    def __init__(self, save_files, tester, deleter, cache=None,
+                 artifacts=None, p0=0.1, trace=None):
+        super().__init__(save_files, tester, deleter, cache=cache,
+                         artifacts=artifacts, trace=trace)
+        self.p0 = p0
+
+    def choose(self, candidates, probability):
+        """Returns the prefix of candidates, sorted by increasing
+        probability, with the largest expected number of items deleted, and
+        that number"""
+        best_gain = 0
+        best_size = 0
+        deletable = 1.0
+        for size, item in enumerate(candidates, 1):
+            deletable *= 1 - probability[item]
+            if size * deletable > best_gain:
+                best_gain = size * deletable
+                best_size = size
+        return candidates[:best_size], best_gain
+
+    def search(self):
+        probability = {item: self.p0 for item in self.deleter.items}
+        to_delete = list()
+        # Subsets already known to fail on top of to_delete, which only
+        # changes when a test passes
+        failed = set()
+        while True:
+            candidates = sorted((x for x in self.deleter.items
+                                 if 0 < probability[x] < 1),
+                                key=probability.get)
+            if not candidates:
+                break
+            subset, gain = self.choose(candidates, probability)
+            log.info(f"Trying {len(subset)} of {len(candidates)} items, "
+                     f"expecting to delete {gain:.2f}")
+            key = frozenset(subset)
+            if key in failed:
+                result = Result.FAIL
+            else:
+                result = self.test(to_delete + subset)
+
+            if result == Result.PASS:
+                to_delete += subset
+                for item in subset:
+                    probability[item] = 0
+                failed.clear()
+            elif len(subset) == 1:
+                probability[subset[0]] = 1
+            else:
+                failed.add(key)
+                fail_probability = 1.0
+                for item in subset:
+                    fail_probability *= 1 - probability[item]
+                fail_probability = 1 - fail_probability
+                for item in subset:
+                    probability[item] = min(
+                        1.0, probability[item] / fail_probability)
+        return to_delete
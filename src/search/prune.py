@@ -0,0 +1,51 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+import logging as log
+import tempfile
+
+from gtirbtools.build import BuildError
+from gtirbtools.coverage import executed_blocks
+
+
+def measure_coverage(deleter, tester):
+    """Runs the test suite on a build of the program that records the
+    blocks it executes. Returns the set of addresses of the blocks that
+    never executed, or None if the instrumented program could not be built
+    or fails the tests. Blocks that could not be instrumented are assumed to
+    execute."""
+    log.info("Measuring block coverage of the tests")
+    with tempfile.TemporaryDirectory(prefix='coverage-',
+                                     dir=deleter.workdir) as build_dir:
+        try:
+            exe, coverage_file, blocks = deleter.instrument(build_dir)
+        except BuildError as e:
+            log.warning(f"Could not build the instrumented program:\n"
+                        f"{e.message}")
+            return None
+        passed, failed = tester.for_binary(exe).run_tests()
+        if failed != 0:
+            log.warning("The instrumented program fails the tests")
+            return None
+        unexecuted = set(blocks) - executed_blocks(coverage_file, blocks)
+    log.info(f"{len(unexecuted)} of {len(blocks)} instrumented blocks "
+             "never executed")
+    return unexecuted
+
+
+def prune_unexecuted(search, unexecuted):
+    """Deletes the items of the search's deleter whose blocks never executed
+    for good, if the program still passes the tests without them. This is
+    tested once, on the IR-based build path. Returns the pruned items."""
+    deleter = search.deleter
+    items = deleter.unexecuted(unexecuted)
+    if not items:
+        return []
+    log.info(f"Pruning {len(items)} of {len(deleter.items)} items that "
+             "never executed")
+    search.test_count += 1
+    outcome = search.evaluator.evaluate(items, search.test_count, final=True)
+    if outcome != 'pass':
+        log.warning("Deleting the items that never executed fails the "
+                    "tests, searching all items")
+        return []
+    deleter.prune(items)
+    return items
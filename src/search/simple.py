@@ -1,12 +1,13 @@
 # Copyright (C) 2020 GrammaTech, Inc.
-from datetime import datetime
+import asyncio
+from enum import Enum
 import logging as log
-import os
-import shutil
 
 from gtirb import *
 
-from gtirbtools.deleter import BlockDeleter, FunctionDeleter, IRGenerationError
+from search.evaluate import Evaluator, run_search
+from search.parallel import make_pool, submit_test
+from search.pipeline import Pipeline
 
 
 class Result(Enum):
@@ -17,56 +18,50 @@ class Result(Enum):
 class Simple():
     """Base class for simple search approaches."""
 
-    def __init__(self, save_files, tester, deleter):
+    def __init__(self, save_files, tester, deleter, jobs=1, cache=None,
+                 artifacts=None, pipeline=None, trace=None):
         self.save_files = save_files
         self.tester = tester
         self.deleter = deleter
+        self.jobs = jobs
+        self.cache = cache
+        # Number of workers per stage when evaluating in a Pipeline
+        self.pipeline = pipeline
+        self.evaluator = Evaluator(deleter, tester, save_files, cache,
+                                   artifacts, trace)
+        self.artifacts = self.evaluator.artifacts
         self.test_count = 0
+        self._pool = None
 
-    def _test(self, items):
-        def finish_test(test_dir, result):
-            def copy_dir(dst):
-                try:
-                    shutil.copytree(src=test_dir, dst=dst)
-                except OSError as e:
-                    log.error(f"Error copying {test_dir} to {dst}:\n{e}")
-            save_dir = os.path.join(self.deleter.workdir,
-                                    result.value,
-                                    str(self.test_count))
-            if self.save_files == 'all':
-                copy_dir(save_dir)
-            elif self.save_files == 'passing' and result == Result.PASS:
-                copy_dir(save_dir)
-            log.info(result.value.upper())
-            return result
-
-        items_list = ' '.join(sorted([str(b) for b in items]))
+    def test(self, items):
+        """Builds and tests a candidate with ITEMS deleted"""
         self.test_count += 1
-        log.info(f"Test #{self.test_count}")
-        log.debug(f"Processing: \n{items_list}")
-
-        try:
-            test_dir = self.deleter.delete(items, str(self.test_count) + '-')
-        except IRGenerationError as e:
-            return finish_test(e.dir_name, Result.FAIL)
-
-        exe = os.path.join(test_dir.name, self.deleter.binary_name)
-        self.tester.binary = exe
-
-        # Run tests
-        log.info("Starting tests")
-        passed, failed = self.tester.run_tests()
-        if failed != 0:
-            return finish_test(test_dir.name, Result.FAIL)
-        else:
-            log.debug("Deleted:\n"
-                      f"{items_list}")
-            new_size = os.stat(exe).st_size
-            finish_test(test_dir.name, Result.PASS)
-            log.info(f"New file size: {new_size} bytes, "
-                     f"{new_size / self.deleter.original_size * 100:.2f}% "
-                     "of original size")
-            return Result.PASS
+        return self._test(items, self.test_count)
+
+    def _test(self, items, test_number, final=False):
+        return Result(self.evaluator.evaluate(items, test_number, final))
+
+    # Asynchronous testing
+    def start_pool(self):
+        """Start a pipeline, or a pool of self.jobs worker processes if
+        jobs > 1"""
+        if self.pipeline is not None:
+            self._pool = Pipeline(self.evaluator, self.pipeline)
+        elif self.jobs > 1:
+            self._pool = make_pool(self, self.jobs)
+
+    def stop_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def submit(self, items):
+        """Schedules a test of ITEMS on the pool, returns a future of its
+        Result"""
+        self.test_count += 1
+        if isinstance(self._pool, Pipeline):
+            return self._pool.submit(items, self.test_count, Result)
+        return submit_test(self._pool, items, self.test_count)
 
     def item_str(self, item):
         return str(item)
@@ -75,15 +70,8 @@ class Simple():
         raise NotImplementedError
 
     def run(self):
-        self.start_time = datetime.now()
-        results = self.search()
-        self.finish_time = datetime.now()
-        log.info(f"Items to delete:\n{' '.join(results)}")
-        runtime = self.finish_time - self.start_time
-        log.info(f"Runtime: {runtime}")
-        log.info("Building and testing final configuration")
-        self._test(results)
-        return results
+        return run_search(self, self.search, "Items to delete",
+                          self.item_str)
 
 
 class Linear(Simple):
@@ -91,21 +79,62 @@ class Linear(Simple):
         to_delete = list()
         for item in self.deleter.items:
             log.info(f"Trying {self.item_str(item)}")
-            result = self._test(to_delete + [item])
+            result = self.test(to_delete + [item])
             if result == Result.PASS:
                 to_delete.append(item)
         return to_delete
 
 
+class Chunked(Simple):
+    """Like Linear, makes one pass over the items, but tries to delete chunks
+    of consecutive items. The chunk size doubles after every chunk that can
+    be deleted and halves after every chunk that cannot, so that k required
+    items take O(k log n) tests. A single item that cannot be deleted is
+    kept and the chunk size starts over at 1."""
+    def search(self):
+        items = self.deleter.items
+        to_delete = list()
+        start = 0
+        size = 1
+        while start < len(items):
+            chunk = items[start:start + size]
+            log.info(f"Trying {len(chunk)} items from "
+                     f"{self.item_str(chunk[0])}")
+            result = self.test(to_delete + chunk)
+            if result == Result.PASS:
+                to_delete += chunk
+                start += len(chunk)
+                size *= 2
+            elif len(chunk) == 1:
+                start += 1
+                size = 1
+            else:
+                size = len(chunk) // 2
+        return to_delete
+
+
 class Bisect(Simple):
+    """Recursively bisects the items, keeping every half that can be
+    deleted. With jobs > 1 or a pipeline, the two halves are explored
+    concurrently and candidates are built and tested asynchronously, up to
+    jobs at the same time."""
     def search(self):
         to_delete = self.deleter.items
+        self.start_pool()
+        if self._pool is not None:
+            loop = asyncio.new_event_loop()
+            try:
+                return loop.run_until_complete(
+                    self.search_parallel(to_delete))
+            finally:
+                loop.close()
+                self.stop_pool()
 
         def search(items):
             log.info(f"Trying {' '.join(self.item_str(x) for x in items)}")
             if items == []:
                 return items
-            result = self._test(items)
+            result = self.test(items)
             if result == Result.PASS:
                 return items
             if len(items) == 1:
@@ -115,17 +144,39 @@ class Bisect(Simple):
             if len(subset) > 1:
                 subset_str = ' '.join(self.item_str(x) for x in subset)
                 log.info(f"Trying combined results {subset_str}")
-                if self._test(subset) == Result.FAIL:
+                if self.test(subset) == Result.FAIL:
                     log.error(f"Subset expected to pass {subset_str}")
             return subset
         return search(to_delete)
 
+    async def search_parallel(self, to_delete):
+        loop = asyncio.get_event_loop()
+
+        async def test(items):
+            return await asyncio.wrap_future(self.submit(items), loop=loop)
+
+        async def search(items):
+            log.info(f"Trying {' '.join(self.item_str(x) for x in items)}")
+            if items == []:
+                return items
+            result = await test(items)
+            if result == Result.PASS:
+                return items
+            if len(items) == 1:
+                return []
+            midpoint = len(items)//2
+            left, right = await asyncio.gather(search(items[:midpoint]),
+                                               search(items[midpoint:]))
+            subset = left + right
+            if len(subset) > 1:
+                subset_str = ' '.join(self.item_str(x) for x in subset)
+                log.info(f"Trying combined results {subset_str}")
+                if await test(subset) == Result.FAIL:
+                    log.error(f"Subset expected to pass {subset_str}")
+            return subset
+
+        return await search(to_delete)
+
     def run(self):
-        self.start_time = datetime.now()
-        results = self.search()
-        self.finish_time = datetime.now()
-        log.info("Items to delete:\n"
-                 f"{' '.join(self.item_str(x) for x in results)}")
-        runtime = self.finish_time - self.start_time
-        log.info(f"Runtime: {runtime}")
-        return results
+        return run_search(self, self.search, "Items to delete",
+                          self.item_str, final=False)
@@ -0,0 +1,118 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+#
+# Trace of the evaluation of every candidate, one JSON record per line:
+#     test       test number
+#     time       when the evaluation finished, in seconds since the epoch
+#     items      number of items deleted
+#     final      whether the candidate was verified on the IR-based path
+#     outcome    "pass" or "fail"
+#     cached     whether the outcome came from the result cache
+#     identical  whether an identical executable was tested before
+#     size       size of the executable, or null if it was not built
+#     tests_run  number of tests run, or null if none were run
+#     test_cpu   CPU seconds of the test processes, or null
+#     total      seconds from the start to the end of the evaluation
+#     stages     seconds spent in every stage of the Evaluator
+#     phases     seconds spent in every phase within the stages, see
+#                gtirbtools.timing
+#     notes      other facts recorded by the phases, such as whether the
+#                executable or objects were reused
+#
+import argparse
+from collections import defaultdict
+import json
+import logging as log
+import os
+
+
+class Trace():
+    """Appends records to a trace file. Every record is written with a single
+    write to the file opened for appending, so threads and worker processes
+    can share a trace."""
+    def __init__(self, trace_file, append=False):
+        self.trace_file = trace_file
+        if not append:
+            open(trace_file, 'w').close()
+
+    def write(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        fd = os.open(self.trace_file,
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def log_summary(self):
+        for line in summarize(read(self.trace_file)):
+            log.info(line)
+
+
+def read(trace_file):
+    """Returns the records of trace_file"""
+    with open(trace_file) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _table(title, seconds, counts, whole):
+    """Lines of a table of the seconds spent in every name, largest first,
+    as a share of whole seconds"""
+    lines = [f"{title:<16}{'seconds':>10}{'count':>8}{'mean':>10}"
+             f"{'share':>8}"]
+    for name, total in sorted(seconds.items(), key=lambda x: -x[1]):
+        share = total / whole * 100 if whole else 0
+        lines.append(f"{name:<16}{total:>10.2f}{counts[name]:>8}"
+                     f"{total / counts[name]:>10.3f}{share:>7.1f}%")
+    return lines
+
+
+def summarize(records):
+    """Returns the lines of a summary of where the time of the records went.
+    Shares are of the time spent in stages, which overlap when candidates
+    are evaluated concurrently."""
+    if not records:
+        return ["No candidates evaluated"]
+    outcomes = defaultdict(int)
+    stages = defaultdict(float)
+    stage_counts = defaultdict(int)
+    phases = defaultdict(float)
+    phase_counts = defaultdict(int)
+    tests_run = 0
+    test_cpu = 0.0
+    for record in records:
+        outcomes[record['outcome']] += 1
+        for name, seconds in record['stages'].items():
+            stages[name] += seconds
+            stage_counts[name] += 1
+        for name, seconds in record['phases'].items():
+            phases[name] += seconds
+            phase_counts[name] += 1
+        tests_run += record['tests_run'] or 0
+        test_cpu += record['test_cpu'] or 0.0
+
+    whole = sum(stages.values())
+    span = (max(r['time'] for r in records)
+            - min(r['time'] - r['total'] for r in records))
+    reused = sum(1 for r in records if r['notes'].get('reused_executable'))
+    lines = [f"{len(records)} candidates in {span:.2f}s: "
+             f"{outcomes['pass']} passed, {outcomes['fail']} failed",
+             f"{sum(r['cached'] for r in records)} outcomes cached, "
+             f"{sum(r['identical'] for r in records)} identical "
+             f"executables, {reused} executables reused",
+             f"{tests_run} tests run, {test_cpu:.2f}s of test CPU time"]
+    lines += _table('Stage', stages, stage_counts, whole)
+    lines += _table('Phase', phases, phase_counts, whole)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Summarize where the time of a search went")
+    parser.add_argument("trace_file", help="trace written with --trace")
+    args = parser.parse_args()
+    for line in summarize(read(args.trace_file)):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
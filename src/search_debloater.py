@@ -10,9 +10,17 @@ import sys
 import os
 from gtirb import *
 
-from gtirbtools.deleter import BlockDeleter, FunctionDeleter
+from gtirbtools.build import BinaryCache
+from gtirbtools.deleter import (AsmFunctionDeleter, BlockDeleter,
+                                FunctionDeleter)
+from search.artifacts import ArtifactStore
+from search.cache import ResultCache
 from search.delta import Delta
-from search.simple import Bisect, Linear
+from search.hierarchical import HDD, Hierarchical
+from search.probdd import ProbDD
+from search.prune import measure_coverage, prune_unexecuted
+from search.simple import Bisect, Chunked, Linear
+from search.trace import Trace
 from testing.grep import GrepTest
 
 
@@ -30,6 +38,10 @@ def main():
                         default='etc/__gtirb_trampoline.S')
     parser.add_argument("--log-file",
                         help="log file")
+    parser.add_argument("--trace",
+                        help="write the timings of every candidate to FILE "
+                        "as JSON lines, and log a summary at the end",
+                        metavar="FILE")
     parser.add_argument("--log-level",
                         help="log level",
                         metavar="LEVEL",
@@ -44,6 +56,74 @@ def main():
                         help="save files generated during the search",
                         choices=['all', 'passing'],
                         default='passing')
+    parser.add_argument("--compress",
+                        help="compress saved files",
+                        action='store_true')
+    parser.add_argument("--keep-passing",
+                        help="only keep the N saved passing candidates with "
+                        "the smallest executables",
+                        metavar="N",
+                        type=int)
+    parser.add_argument("--search",
+                        help="search strategy",
+                        choices=['bisect', 'chunked', 'delta', 'linear',
+                                 'probdd'],
+                        default='bisect')
+    parser.add_argument("-j", "--jobs",
+                        help="number of candidates to build and test "
+                        "in parallel (bisect and delta)",
+                        metavar="N",
+                        type=int,
+                        default=1)
+    parser.add_argument("--pipeline",
+                        help="build and test candidates in a pipeline with "
+                        "N workers per stage (bisect and delta)",
+                        metavar="N",
+                        type=int)
+    parser.add_argument("--test-jobs",
+                        help="number of test cases to run in parallel "
+                        "for each candidate",
+                        metavar="N",
+                        type=int,
+                        default=1)
+    parser.add_argument("--corpus",
+                        help="serve the tests from a corpus file packed "
+                        "with 'python3 -m testing.corpus'",
+                        metavar="FILE")
+    parser.add_argument("--no-cache",
+                        help="do not reuse or record test results in the "
+                        "working directory",
+                        action='store_true')
+    parser.add_argument("--binary-cache-size",
+                        help="keep at most MB megabytes of executables for "
+                        "reuse by candidates with identical assembly",
+                        metavar="MB",
+                        type=int,
+                        default=1024)
+    parser.add_argument("--resume",
+                        help="resume a delta search from the last "
+                        "checkpoint in the working directory",
+                        action='store_true')
+    parser.add_argument("--blocks",
+                        help="after reducing functions, reduce the basic "
+                        "blocks of the remaining functions",
+                        action='store_true')
+    parser.add_argument("--hdd",
+                        help="delete basic blocks, reducing modules, then "
+                        "functions, then blocks with the search strategy",
+                        action='store_true')
+    parser.add_argument("--prune-unexecuted",
+                        help="measure the block coverage of the tests and "
+                        "delete what never executes before searching",
+                        action='store_true')
+    parser.add_argument("--splice-asm",
+                        help="generate candidates by splicing functions out "
+                        "of the original assembly instead of rewriting the IR",
+                        action='store_true')
+    parser.add_argument("--incremental",
+                        help="assemble functions separately and reuse "
+                        "unchanged objects between candidates",
+                        action='store_true')
 
     args = parser.parse_args()
     if not os.path.exists(args.in_file):
@@ -60,16 +140,88 @@ def main():
         fh.setFormatter(log.Formatter(format))
         log.getLogger().addHandler(fh)
 
-    tester = GrepTest(limit_bin='/development/src/testing/limit',
-                      tests_dir='/development/grep-generated-tests',
-                      flag='c')
-    deleter = FunctionDeleter(infile=args.in_file,
-                              trampoline=args.tramp,
-                              workdir=args.workdir,
-                              binary_name='grep',
-                              build_flags=['-lm', '-lresolv'])
-    search = Bisect(save_files=args.save, tester=tester, deleter=deleter)
+    tester = GrepTest(tests_dir='/development/grep-generated-tests',
+                      flag='c',
+                      jobs=args.test_jobs,
+                      corpus=args.corpus)
+    trace = None
+    if args.trace:
+        trace = Trace(args.trace, append=args.resume)
+    binary_cache = None
+    if not args.no_cache:
+        binary_cache = BinaryCache(os.path.join(args.workdir, 'binaries'),
+                                   max_size=args.binary_cache_size << 20)
+    if args.hdd:
+        deleter_class = BlockDeleter
+    elif args.splice_asm:
+        deleter_class = AsmFunctionDeleter
+    else:
+        deleter_class = FunctionDeleter
+    deleter = deleter_class(infile=args.in_file,
+                            trampoline=args.tramp,
+                            workdir=args.workdir,
+                            binary_name='grep',
+                            build_flags=['-lm', '-lresolv'],
+                            incremental=args.incremental,
+                            binary_cache=binary_cache)
+
+    def make_search(deleter):
+        cache = None
+        if not args.no_cache:
+            cache = ResultCache(os.path.join(deleter.workdir, 'cache.sqlite'),
+                                deleter=deleter, tester=tester)
+        artifacts = ArtifactStore(deleter.workdir, compress=args.compress,
+                                  keep_passing=args.keep_passing)
+        if args.search == 'delta':
+            return Delta(save_files=args.save, tester=tester, deleter=deleter,
+                         jobs=args.jobs, cache=cache, resume=args.resume,
+                         artifacts=artifacts, pipeline=args.pipeline,
+                         trace=trace)
+        elif args.search == 'probdd':
+            return ProbDD(save_files=args.save, tester=tester,
+                          deleter=deleter, cache=cache, artifacts=artifacts,
+                          trace=trace)
+        elif args.search == 'chunked':
+            return Chunked(save_files=args.save, tester=tester,
+                           deleter=deleter, cache=cache, artifacts=artifacts,
+                           trace=trace)
+        elif args.search == 'linear':
+            return Linear(save_files=args.save, tester=tester,
+                          deleter=deleter, cache=cache, artifacts=artifacts,
+                          trace=trace)
+        return Bisect(save_files=args.save, tester=tester, deleter=deleter,
+                      jobs=args.jobs, cache=cache, artifacts=artifacts,
+                      pipeline=args.pipeline, trace=trace)
+
+    def make_block_search(ir_file, functions, workdir):
+        block_deleter = BlockDeleter(infile=ir_file,
+                                     trampoline=args.tramp,
+                                     workdir=workdir,
+                                     binary_name='grep',
+                                     build_flags=['-lm', '-lresolv'],
+                                     incremental=args.incremental,
+                                     binary_cache=binary_cache,
+                                     functions=functions)
+        search = make_search(block_deleter)
+        if unexecuted is not None:
+            prune_unexecuted(search, unexecuted)
+        return search
+
+    unexecuted = None
+    if args.prune_unexecuted:
+        unexecuted = measure_coverage(deleter, tester)
+    search = make_search(deleter)
+    if unexecuted is not None:
+        prune_unexecuted(search, unexecuted)
+    if args.hdd:
+        search = HDD(deleter, make_search)
+    elif args.blocks:
+        search = Hierarchical(search, make_block_search)
     results = search.run()
+    if binary_cache is not None:
+        binary_cache.clear()
+    if trace is not None:
+        trace.log_summary()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,96 @@
+# Copyright (C) 2020 GrammaTech, Inc.
+#
+# Test directories packed into a single indexed file, so that test cases
+# are served from memory instead of being read from many small files
+#
+# Layout: MAGIC, the offset of the index as an unsigned little-endian 64 bit
+# integer, the contents of every file, then the index as JSON:
+#     {"tests": [[test_id, {file name: [offset, length]}], ...]}
+# Tests are stored in increasing order of size of their input and pattern.
+#
+import argparse
+import json
+import logging as log
+import mmap
+import os
+import struct
+
+from testing.test import TestError
+
+MAGIC = b'GTCORPUS1\n'
+_OFFSET = struct.Struct('<Q')
+
+
+class CorpusError(TestError):
+    def __init__(self, message):
+        log.error(message)
+        self.message = message
+
+
+def pack(tests_dir, corpus_file):
+    """Packs test_dir/[test_id]/* into corpus_file. Returns the number of
+    tests packed."""
+    with os.scandir(tests_dir) as entries:
+        tests = [(t.name, t.path) for t in entries if t.is_dir()]
+
+    def size(test):
+        return sum(os.stat(os.path.join(test[1], f)).st_size
+                   for f in ('input', 'pattern'))
+
+    index = list()
+    tmp_name = f"{corpus_file}.{os.getpid()}"
+    with open(tmp_name, 'wb') as out:
+        out.write(MAGIC)
+        out.write(_OFFSET.pack(0))
+        for test_id, path in sorted(tests, key=size):
+            files = dict()
+            for name in sorted(os.listdir(path)):
+                with open(os.path.join(path, name), 'rb') as f:
+                    contents = f.read()
+                files[name] = [out.tell(), len(contents)]
+                out.write(contents)
+            index.append([test_id, files])
+        index_offset = out.tell()
+        out.write(json.dumps({'tests': index}).encode('utf-8'))
+        out.seek(len(MAGIC))
+        out.write(_OFFSET.pack(index_offset))
+    os.replace(tmp_name, corpus_file)
+    return len(index)
+
+
+class Corpus():
+    """A packed test corpus, memory-mapped. Files are returned as
+    memoryviews of the mapping, without copying."""
+    def __init__(self, corpus_file):
+        self.corpus_file = corpus_file
+        with open(corpus_file, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise CorpusError(f"{corpus_file} is not a test corpus")
+        index_offset, = _OFFSET.unpack_from(self._map, len(MAGIC))
+        index = json.loads(self._map[index_offset:].decode('utf-8'))
+        self._view = memoryview(self._map)
+        # Test ID -> file name -> (offset, length)
+        self._files = {test_id: files for test_id, files in index['tests']}
+        self.test_ids = [test_id for test_id, _ in index['tests']]
+
+    def read(self, test_id, name):
+        """Returns the contents of file name of test_id"""
+        offset, length = self._files[test_id][name]
+        return self._view[offset:offset + length]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pack a directory of test cases into a corpus file")
+    parser.add_argument("tests_dir",
+                        help="directory holding a directory per test case")
+    parser.add_argument("corpus_file",
+                        help="corpus file to write")
+    args = parser.parse_args()
+    count = pack(args.tests_dir, args.corpus_file)
+    print(f"Packed {count} tests into {args.corpus_file}")
+
+
+if __name__ == '__main__':
+    main()
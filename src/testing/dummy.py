@@ -7,6 +7,9 @@ class PassTest(Test):
     def __init__(self, **kwargs):
         pass
 
+    def identity(self):
+        return type(self).__name__
+
     def run_tests(self, **kwargs):
         return (1, 0)
 
@@ -16,5 +19,8 @@ class FailTest(Test):
     def __init__(self, **kwargs):
         pass
 
+    def identity(self):
+        return type(self).__name__
+
     def run_tests(self, **kwargs):
         return (0, 1)
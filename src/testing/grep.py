@@ -4,6 +4,7 @@ import os
 
 from collections import defaultdict
 
+from testing.corpus import Corpus
 from testing.test import Test, Result
 
 
@@ -11,16 +12,23 @@ class GrepTest(Test):
     """Testing for the grep-single-file binary.
     Assumes the following layout for a test directory:
         test_dir/[flag]/[test_id]/{input,pattern,returncode,stderr,stdout}
+    If corpus is given, the tests are served from that file instead, packed
+    from test_dir/[flag] by testing.corpus.
     """
-    def __init__(self, limit_bin, tests_dir, flag=None):
+    def __init__(self, tests_dir, flag=None, jobs=1, corpus=None):
         if flag is not None:
             tests_dir = os.path.join(tests_dir, flag)
             flag = '-' + flag
         else:
             tests_dir = os.path.join(tests_dir, 'vanilla')
         self.flag = flag
-        super().__init__(limit_bin, tests_dir)
-        self.test_ids = self.get_tests_sorted()
+        super().__init__(tests_dir, jobs=jobs)
+        self.corpus = None
+        if corpus is not None:
+            self.corpus = Corpus(corpus)
+            self.test_ids = self.corpus.test_ids
+        else:
+            self.test_ids = self.get_tests_sorted()
 
     def get_tests_sorted(self):
         """Lists test IDs in increasing order of size of pattern + input."""
@@ -32,20 +40,37 @@ class GrepTest(Test):
                 file_info[t.name] += size
         return [f[0] for f in sorted(file_info.items(), key=lambda f: f[1])]
 
+    def identity(self):
+        return f"{super().identity()} {self.flag}"
+
     def test_one(self, test_id):
         """Runs a single test case"""
-        test_dir = os.path.join(self.tests_dir, test_id)
-        pattern, stdout, stderr, returncode = \
-            (Test.read_file(os.path.join(test_dir, f))
-             for f in ('pattern', 'stdout', 'stderr', 'returncode'))
+        if self.corpus is not None:
+            pattern, stdout, stderr, returncode = \
+                (self.corpus.read(test_id, f)
+                 for f in ('pattern', 'stdout', 'stderr', 'returncode'))
+            pattern = bytes(pattern)
+        else:
+            test_dir = os.path.join(self.tests_dir, test_id)
+            pattern, stdout, stderr, returncode = \
+                (Test.read_file(os.path.join(test_dir, f))
+                 for f in ('pattern', 'stdout', 'stderr', 'returncode'))
 
         # Decode and convert returncode to int
-        returncode = int(returncode.decode('utf-8').strip())
+        returncode = int(bytes(returncode).decode('utf-8').strip())
         command = [self.binary, '-e', pattern]
         if self.flag is not None:
             command.append(self.flag)
-        with open(os.path.join(test_dir, 'input'), 'rb') as input_file:
-            result = self.run_limited(command, stdin=input_file)
+        if self.corpus is not None:
+            result = self.run_limited(
+                command, input=self.corpus.read(test_id, 'input'))
+        else:
+            with open(os.path.join(test_dir, 'input'), 'rb') as input_file:
+                result = self.run_limited(command, stdin=input_file)
+        if result.rusage is not None:
+            log.debug(f"{test_id}: {result.rusage.ru_utime:.3f}s user, "
+                      f"{result.rusage.ru_stime:.3f}s system, "
+                      f"{result.rusage.ru_maxrss} KiB")
 
         if (stdout, stderr, returncode) == \
            (result.stdout, result.stderr, result.returncode):
@@ -1,8 +1,16 @@
 # Copyright (C) 2020 GrammaTech, Inc.
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import copy
 import enum
+import functools
 import logging as log
 import os
+import resource
+import signal
 import subprocess as sp
+import threading
+import time
 
 
 class TestError(Exception):
@@ -15,11 +23,6 @@ class ReadError(TestError):
         self.message = message
 
 
-class LimitBinaryError(TestError):
-    def __init__(self):
-        log.error("Could not run 'limit', have you compiled it?")
-
-
 class NoBinaryError(TestError):
     def __init__(self):
         log.error("No binary provided for testing")
@@ -30,18 +33,118 @@ class Result(enum.Enum):
     FAIL = "fail"
 
 
+# Resource limits of test processes, on top of the CPU time limit
+LIMITS = ((resource.RLIMIT_AS, 2 * 1024 * 1024 * 1024),
+          (resource.RLIMIT_CORE, 0),
+          (resource.RLIMIT_FSIZE, 2 * 1024 * 1024 * 1024),
+          (resource.RLIMIT_NOFILE, 128),
+          (resource.RLIMIT_NPROC, 1024))
+
+
+def _set_limits(limits):
+    """Lowers the resource limits of the calling process, runs in the test
+    process between fork and exec. Limits above the hard limit are left
+    alone."""
+    for resource_id, value in limits:
+        soft, hard = resource.getrlimit(resource_id)
+        if hard != resource.RLIM_INFINITY and hard < value:
+            continue
+        if soft == resource.RLIM_INFINITY or soft > value:
+            soft = value
+        resource.setrlimit(resource_id, (soft, value))
+
+
+class LimitedProcess(sp.Popen):
+    """A test process in its own session, so that it and its children can be
+    killed together, which keeps its resource usage once it is reaped"""
+    rusage = None
+
+    def _try_wait(self, wait_flags):
+        try:
+            pid, status, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return self.pid, 0
+        if pid != 0:
+            self.rusage = rusage
+        return pid, status
+
+    def kill_group(self):
+        try:
+            os.killpg(self.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+class TestHistory():
+    """How often each test failed a candidate and how long it takes, used to
+    run the tests most likely to fail a candidate, per second they take,
+    first. Shared by the copies made by Test.for_binary(); worker processes
+    each keep their own."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = defaultdict(int)
+        self.failures = defaultdict(int)
+        self.seconds = defaultdict(float)
+
+    def record(self, test_id, seconds, result):
+        with self._lock:
+            self.runs[test_id] += 1
+            self.seconds[test_id] += seconds
+            if result == Result.FAIL:
+                self.failures[test_id] += 1
+
+    def order(self, test_ids):
+        """Sorts test_ids by expected time per failure, keeping their order
+        among tests without history. The failure rate is smoothed so that
+        tests that have not run yet are tried early."""
+        with self._lock:
+            total_runs = sum(self.runs.values())
+            mean = sum(self.seconds.values()) / total_runs if total_runs else 0
+
+            def cost(item):
+                index, test_id = item
+                runs = self.runs.get(test_id, 0)
+                seconds = self.seconds[test_id] / runs if runs else mean
+                rate = (self.failures.get(test_id, 0) + 0.1) / (runs + 1)
+                return (seconds / rate, index)
+
+            return [test_id for _, test_id in sorted(enumerate(test_ids),
+                                                     key=cost)]
+
+
 class Test():
-    def __init__(self, limit_bin, tests_dir, limit=1):
+    """Base class for test suites. Every test process runs with the resource
+    LIMITS and is killed with its children after limit seconds, or limit
+    seconds of CPU time (0 for no limit)."""
+    def __init__(self, tests_dir, limit=1, jobs=1):
         self.binary = None
-        self.limit_bin = limit_bin
         self.tests_dir = tests_dir
-        self.limit = str(limit)
+        self.limit = limit
+        limits = LIMITS
+        if limit > 0:
+            limits += ((resource.RLIMIT_CPU, limit),)
+        self._preexec = functools.partial(_set_limits, limits)
+        self.jobs = jobs
         self.test_ids = None
-        # Check limit binary
-        try:
-            sp.run([limit_bin], stdout=sp.DEVNULL, stderr=sp.DEVNULL)
-        except Exception:
-            raise LimitBinaryError
+        self.history = TestHistory()
+        # Test processes in flight, so that they can be killed when another
+        # test fails
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._cancelled = threading.Event()
+        # CPU time of the test processes run by this copy
+        self.cpu_seconds = 0.0
+
+    def for_binary(self, binary):
+        """Returns a copy of this test suite for binary, which can run
+        concurrently with this one"""
+        tester = copy.copy(self)
+        tester.binary = binary
+        tester._running = set()
+        tester._running_lock = threading.Lock()
+        tester._cancelled = threading.Event()
+        tester.cpu_seconds = 0.0
+        return tester
 
     @staticmethod
     def read_file(file_path):
@@ -52,14 +155,76 @@ class Test():
             raise ReadError(f"Could not read file {path}")
         return contents
 
-    def run_limited(self, command, stdin=None):
-        limit_command = [self.limit_bin, self.limit] + command
-        return sp.run(limit_command, stdin=stdin,
-                      stdout=sp.PIPE, stderr=sp.PIPE)
+    def run_limited(self, command, stdin=None, input=None):
+        """Runs command with resource limits. stdin is a file, or input the
+        bytes (or a buffer) to write to its standard input. Returns a
+        CompletedProcess with the resource usage of the command as rusage.
+
+        Exit codes and messages are those of the former 'limit' wrapper: a
+        command killed by a signal returns the signal number and reports
+        "Killed (signal)" on standard error."""
+        if input is not None:
+            stdin = sp.PIPE
+        try:
+            proc = LimitedProcess(command, stdin=stdin, stdout=sp.PIPE,
+                                  stderr=sp.PIPE, start_new_session=True,
+                                  preexec_fn=self._preexec)
+        except (OSError, sp.SubprocessError) as e:
+            result = sp.CompletedProcess(command, 127, b'',
+                                         f"{e}\n".encode('utf-8'))
+            result.rusage = None
+            return result
+        with proc:
+            with self._running_lock:
+                self._running.add(proc)
+                if self._cancelled.is_set():
+                    proc.kill_group()
+            try:
+                try:
+                    stdout, stderr = proc.communicate(
+                        input, timeout=self.limit or None)
+                except sp.TimeoutExpired:
+                    proc.kill_group()
+                    stdout, stderr = proc.communicate()
+            finally:
+                # Also kill what the command left running
+                proc.kill_group()
+                with self._running_lock:
+                    self._running.discard(proc)
+        returncode = proc.returncode
+        if returncode < 0:
+            stderr += f"Killed ({-returncode})\n".encode('utf-8')
+            returncode = -returncode
+        result = sp.CompletedProcess(command, returncode, stdout, stderr)
+        result.rusage = proc.rusage
+        if proc.rusage is not None:
+            with self._running_lock:
+                self.cpu_seconds += (proc.rusage.ru_utime
+                                     + proc.rusage.ru_stime)
+        return result
+
+    def cancel_running(self):
+        """Kills every test process in flight"""
+        with self._running_lock:
+            self._cancelled.set()
+            for proc in self._running:
+                proc.kill_group()
+
+    def identity(self):
+        """Returns a string identifying the test suite"""
+        return ' '.join([type(self).__name__,
+                         os.path.abspath(self.tests_dir),
+                         str(self.limit)])
 
     def test_one(self, test_id):
         raise NotImplementedError
 
+    def _timed(self, test_id):
+        """Runs test_id, returns its result and how long it took"""
+        start = time.monotonic()
+        result = self.test_one(test_id)
+        return result, time.monotonic() - start
+
     def run_tests(self, max_tests=None, fail_early=True):
         """Runs tests. Returns a tuple of (num_passed, num_failed)"""
         if self.binary is None:
@@ -70,8 +235,12 @@ class Test():
             tests_to_run = self.test_ids
         else:
             tests_to_run = self.test_ids[:max_tests]
+        tests_to_run = self.history.order(tests_to_run)
+        if self.jobs > 1:
+            return self.run_tests_parallel(tests_to_run, fail_early)
         for test_id in tests_to_run:
-            result = self.test_one(test_id)
+            result, seconds = self._timed(test_id)
+            self.history.record(test_id, seconds, result)
             if result == Result.FAIL:
                 log.debug(f"{test_id}: FAIL")
                 failed += 1
@@ -82,3 +251,44 @@ class Test():
                 passed += 1
         log.debug(f"Passed: {passed}, Failed: {failed}")
         return (passed, failed)
+
+    def run_tests_parallel(self, tests_to_run, fail_early=True):
+        """Runs tests with up to self.jobs test processes in flight. With
+        fail_early, the first failure kills the running tests and skips the
+        rest. Returns a tuple of (num_passed, num_failed)"""
+        passed = 0
+        failed = 0
+        self._cancelled.clear()
+        remaining = iter(tests_to_run)
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            # Only submit as many tests as can run, so there is nothing
+            # queued to cancel after a failure
+            running = dict()
+
+            def submit_next():
+                test_id = next(remaining, None)
+                if test_id is not None:
+                    running[executor.submit(self._timed, test_id)] = test_id
+
+            for _ in range(self.jobs):
+                submit_next()
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    test_id = running.pop(future)
+                    # Tests killed after a failure are not recorded
+                    result, seconds = future.result()
+                    self.history.record(test_id, seconds, result)
+                    if result == Result.FAIL:
+                        log.debug(f"{test_id}: FAIL")
+                        failed += 1
+                    else:
+                        log.debug(f"{test_id}: OK")
+                        passed += 1
+                if failed != 0 and fail_early:
+                    self.cancel_running()
+                    break
+                for _ in done:
+                    submit_next()
+        log.debug(f"Passed: {passed}, Failed: {failed}")
+        return (passed, failed)